@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+benchmark_evaluator.py
+
+Throughput and ranking fidelity of the TranslationEvaluator tiers.
+
+Usage:
+  python benchmark_evaluator.py [--input ./en_zh_book_ds] [--split valid] \
+      [--limit 2000] [--tiers accurate fast fastest]
+
+Scores the same held-out pairs with every tier and reports pairs/sec and
+the Spearman rank correlation of its F1 with the full model's ("accurate").
+Filtering only needs the ranking to survive, so rank correlation is the
+number to look at when picking a tier for bulk jobs.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from jsonl_writer import iter_jsonl
+from translation_evaluator import TIERS, TranslationEvaluator
+
+
+def load_pairs(path: Path, split: str, limit: int):
+    """(zh, en) pairs from an en_zh_book_ds split or an Alpaca JSONL file."""
+    if (path / "dataset_dict.json").exists():
+        from datasets import load_from_disk
+        ds = load_from_disk(str(path))[split]
+        rows = ds[:limit]
+        return list(zip(rows["zh"], rows["en"]))
+    pairs = []
+    for record in iter_jsonl(path):
+        pairs.append((record["output"], record["input"]))
+        if len(pairs) == limit:
+            break
+    return pairs
+
+
+def spearman(a, b):
+    """Spearman rank correlation (ties broken by order, fine for float scores)."""
+    ra = np.argsort(np.argsort(a)).astype(np.float64)
+    rb = np.argsort(np.argsort(b)).astype(np.float64)
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark evaluator speed/accuracy tiers")
+    parser.add_argument("--input", default="./en_zh_book_ds", help="en_zh_book_ds directory or Alpaca JSONL")
+    parser.add_argument("--split", default="valid", help="held-out split of a dataset directory")
+    parser.add_argument("--limit", type=int, default=2000, help="number of pairs to score")
+    parser.add_argument("--tiers", nargs="+", default=list(TIERS), choices=list(TIERS))
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    pairs = load_pairs(Path(args.input), args.split, args.limit)
+    zh = [p[0] for p in pairs]
+    en = [p[1] for p in pairs]
+    print(f"🔹 {len(pairs)} held-out pairs from {args.input}")
+
+    tiers = ["accurate"] + [t for t in args.tiers if t != "accurate"]
+    results = {}
+    for tier in tiers:
+        evaluator = TranslationEvaluator(tier=tier)
+        evaluator.evaluate_batch(zh[:args.batch_size], en[:args.batch_size], batch_size=args.batch_size)  # warm-up
+        start = time.perf_counter()
+        f1 = evaluator.evaluate_batch(zh, en, batch_size=args.batch_size)["f1"]
+        elapsed = time.perf_counter() - start
+        results[tier] = (evaluator.model_id, len(pairs) / elapsed, f1)
+        del evaluator
+
+    ref_f1 = results["accurate"][2]
+    print(f"\n{'tier':<10} {'model':<50} {'pairs/sec':>10} {'spearman':>9}")
+    for tier in tiers:
+        model_id, rate, f1 = results[tier]
+        print(f"{tier:<10} {model_id:<50} {rate:>10.1f} {spearman(ref_f1, f1):>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
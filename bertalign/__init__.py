@@ -5,12 +5,39 @@ Bertalign initialization
 __author__ = "Jason (bfsujason@163.com)"
 __version__ = "1.1.0"
 
-from bertalign.encoder import Encoder
+import importlib
+import os
+
+from bertalign.store import SentenceStore
 
 # See other cross-lingual embedding models at
 # https://www.sbert.net/docs/pretrained_models.html
 
 model_name = "LaBSE"
-model = Encoder(model_name)
 
-from bertalign.aligner import Bertalign
+# Inference backend: "torch", "quantized" (int8) or "onnx"; see bertalign.encoder.
+# Set BERTALIGN_BACKEND, or assign bertalign.model_backend before the model is used.
+model_backend = os.environ.get("BERTALIGN_BACKEND", "torch")
+
+# Encoding processes (0 = encode in this process) and torch threads per process;
+# BERTALIGN_WORKERS / BERTALIGN_THREADS or assign before the model is used.
+model_workers = int(os.environ.get("BERTALIGN_WORKERS", 0))
+model_threads = int(os.environ.get("BERTALIGN_THREADS", 0)) or None
+
+# The encoder is created on first access (``from bertalign import model``)
+# so that worker processes importing this package don't load it. Bertalign
+# and Encoder are imported on first access too: bertalign.store and
+# bertalign.chapter only need numpy, and must not pull in torch, faiss and numba.
+_model = None
+_LAZY = {"Bertalign": "bertalign.aligner", "Encoder": "bertalign.encoder"}
+
+def __getattr__(name):
+    global _model
+    if name == "model":
+        if _model is None:
+            from bertalign.encoder import Encoder
+            _model = Encoder(model_name, model_backend, model_workers, model_threads)
+        return _model
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
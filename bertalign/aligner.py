@@ -1,6 +1,8 @@
+import threading
+
 import numpy as np
 
-from bertalign import model
+import bertalign
 from bertalign.corelib import *
 from bertalign.utils import *
 
@@ -15,7 +17,17 @@ class Bertalign:
                  margin=True,
                  len_penalty=True,
                  is_split=False,
+                 src_lang=None,
+                 tgt_lang=None,
+                 src_embeddings=None,
+                 tgt_embeddings=None,
                ):
+        """
+        src/tgt: text, or already split sentences (a list or SentenceStore).
+        src_lang/tgt_lang: ISO codes; skip language detection when given.
+        src_embeddings/tgt_embeddings: (vecs, lens) from Encoder.transform
+            computed with at least max_align - 1 overlaps; skip encoding when given.
+        """
         
         self.max_align = max_align
         self.top_k = top_k
@@ -24,17 +36,23 @@ class Bertalign:
         self.margin = margin
         self.len_penalty = len_penalty
         
-        src = clean_text(src)
-        tgt = clean_text(tgt)
-        src_lang = detect_lang(src)
-        tgt_lang = detect_lang(tgt)
-        
-        if is_split:
-            src_sents = src.splitlines()
-            tgt_sents = tgt.splitlines()
+        if not isinstance(src, str) and not isinstance(tgt, str):
+            src_sents = src
+            tgt_sents = tgt
+            src_lang = src_lang or detect_lang(" ".join(src[:20]))
+            tgt_lang = tgt_lang or detect_lang(" ".join(tgt[:20]))
         else:
-            src_sents = split_sents(src, src_lang)
-            tgt_sents = split_sents(tgt, tgt_lang)
+            src = clean_text(src)
+            tgt = clean_text(tgt)
+            src_lang = src_lang or detect_lang(src)
+            tgt_lang = tgt_lang or detect_lang(tgt)
+            
+            if is_split:
+                src_sents = src.splitlines()
+                tgt_sents = tgt.splitlines()
+            else:
+                src_sents = split_sents(src, src_lang)
+                tgt_sents = split_sents(tgt, tgt_lang)
  
         src_num = len(src_sents)
         tgt_num = len(tgt_sents)
@@ -45,9 +63,19 @@ class Bertalign:
         print("Source language: {}, Number of sentences: {}".format(src_lang, src_num))
         print("Target language: {}, Number of sentences: {}".format(tgt_lang, tgt_num))
 
-        print("Embedding source and target text using {} ...".format(model.model_name))
-        src_vecs, src_lens = model.transform(src_sents, max_align - 1)
-        tgt_vecs, tgt_lens = model.transform(tgt_sents, max_align - 1)
+        if src_embeddings is None or tgt_embeddings is None:
+            model = bertalign.model
+            print("Embedding source and target text using {} ...".format(model.model_name))
+        if src_embeddings is None:
+            src_embeddings = model.transform(src_sents, max_align - 1)
+        if tgt_embeddings is None:
+            tgt_embeddings = model.transform(tgt_sents, max_align - 1)
+        src_vecs, src_lens = src_embeddings
+        tgt_vecs, tgt_lens = tgt_embeddings
+        if src_vecs.shape[1] != src_num or tgt_vecs.shape[1] != tgt_num:
+            raise ValueError("Precomputed embeddings do not match the number of sentences")
+        if src_vecs.shape[0] < max_align - 1 or tgt_vecs.shape[0] < max_align - 1:
+            raise ValueError("Precomputed embeddings have fewer than max_align - 1 overlaps")
 
         char_ratio = np.sum(src_lens[0,]) / np.sum(tgt_lens[0,])
 
@@ -62,26 +90,67 @@ class Bertalign:
         self.char_ratio = char_ratio
         self.src_vecs = src_vecs
         self.tgt_vecs = tgt_vecs
+        self._top_k_cache = {}
+        self._top_k_lock = threading.Lock()
         
-    def align_sents(self):
+    # Parameters align_sents can override without re-encoding
+    ALIGN_PARAMS = ("max_align", "top_k", "win", "skip", "margin", "len_penalty")
+
+    def align_sents(self, **overrides):
+        """
+        Align with the parameters given to __init__, or overrides of ALIGN_PARAMS
+        applied to this call only (see align). Stores the alignment as
+        self.result and its bead scores as self.scores, and returns the alignment.
+        """
+        print("Performing alignment ...")
+        result, scores = self.align(**overrides)
+        print("Finished! Successfully aligning {} {} sentences to {} {} sentences\n".format(self.src_num, self.src_lang, self.tgt_num, self.tgt_lang))
+        self.result = result
+        # scores[k] holds similarity / margin / length_penalty / score of result[k] (see BEAD_SCORE_DTYPE)
+        self.scores = scores
+        return result
 
-        print("Performing first-step alignment ...")
-        D, I = find_top_k_sents(self.src_vecs[0,:], self.tgt_vecs[0,:], k=self.top_k)
+    def align(self, **overrides):
+        """
+        Run both alignment passes with overrides of ALIGN_PARAMS and return
+        (alignment, bead scores) without printing or storing anything, so
+        several parameter sets can run concurrently on one object. The sentence
+        vectors are reused, so max_align may not exceed the encoded depth
+        (overlaps + 1).
+        """
+        unknown = set(overrides) - set(self.ALIGN_PARAMS)
+        if unknown:
+            raise TypeError("Unknown alignment parameters: {}".format(", ".join(sorted(unknown))))
+        params = {name: overrides.get(name, getattr(self, name)) for name in self.ALIGN_PARAMS}
+        if params["max_align"] - 1 > self.src_vecs.shape[0] or params["max_align"] - 1 > self.tgt_vecs.shape[0]:
+            raise ValueError("max_align {} exceeds the encoded depth {}".format(
+                params["max_align"], min(self.src_vecs.shape[0], self.tgt_vecs.shape[0]) + 1))
+
+        # first pass: 1-1 anchors
+        D, I = self._top_k(params["top_k"])
         first_alignment_types = get_alignment_types(2) # 0-1, 1-0, 1-1
         first_w, first_path = find_first_search_path(self.src_num, self.tgt_num)
         first_pointers = first_pass_align(self.src_num, self.tgt_num, first_w, first_path, first_alignment_types, D, I)
         first_alignment = first_back_track(self.src_num, self.tgt_num, first_pointers, first_path, first_alignment_types)
         
-        print("Performing second-step alignment ...")
-        second_alignment_types = get_alignment_types(self.max_align)
-        second_w, second_path = find_second_search_path(first_alignment, self.win, self.src_num, self.tgt_num)
+        # second pass: m-n beads around the anchors
+        second_alignment_types = get_alignment_types(params["max_align"])
+        second_w, second_path = find_second_search_path(first_alignment, params["win"], self.src_num, self.tgt_num)
         second_pointers = second_pass_align(self.src_vecs, self.tgt_vecs, self.src_lens, self.tgt_lens,
                                             second_w, second_path, second_alignment_types,
-                                            self.char_ratio, self.skip, margin=self.margin, len_penalty=self.len_penalty)
+                                            self.char_ratio, params["skip"],
+                                            margin=params["margin"], len_penalty=params["len_penalty"])
         second_alignment = second_back_track(self.src_num, self.tgt_num, second_pointers, second_path, second_alignment_types)
-        
-        print("Finished! Successfully aligning {} {} sentences to {} {} sentences\n".format(self.src_num, self.src_lang, self.tgt_num, self.tgt_lang))
-        self.result = second_alignment
+        scores = bead_scores(second_alignment, self.src_vecs, self.tgt_vecs, self.src_lens, self.tgt_lens,
+                             self.char_ratio, params["skip"], margin=params["margin"], len_penalty=params["len_penalty"])
+        return second_alignment, scores
+
+    def _top_k(self, k):
+        # the first-pass search only depends on top_k; keep it across calls
+        with self._top_k_lock:
+            if k not in self._top_k_cache:
+                self._top_k_cache[k] = find_top_k_sents(self.src_vecs[0,:], self.tgt_vecs[0,:], k=k)
+            return self._top_k_cache[k]
     
     def print_sents(self):
         for bead in (self.result):
@@ -0,0 +1,169 @@
+"""
+Chapter matching.
+
+Whole books make one large DP problem, and an alignment error early in the
+book can drag the search path off for many sentences. When the document
+structure of both books is known, chapters are matched first and each matched
+chapter pair is then aligned on its own.
+
+Chapters are matched with a small monotonic DP over chapter beads (1-1, 1-2,
+2-1 and skips, since EPUBs of the same book often split chapters into files
+differently). A bead is scored from
+  - the cosine of the chapter vectors, i.e. the normalised sum of the
+    chapter's sentence embeddings (no extra encoder pass),
+  - a bonus or malus when both titles carry a chapter number
+    ("Chapter 12", "第十二章", or a bare "XII" in a table-of-contents title),
+  - a length factor like the sentence-level one (log2(1 + min/max) of the
+    character lengths scaled by the book-level ratio).
+"""
+
+import re
+
+import numpy as np
+
+CHAPTER_TYPES = ((1, 1), (1, 2), (2, 1), (1, 0), (0, 1))
+
+_ZH_NUM = re.compile(r"第\s*([0-9零〇一二两三四五六七八九十百千]+)\s*[章回节卷部篇]")
+_EN_NUM = re.compile(r"^\s*(?:chapter|chap\.|book|part)\s+([0-9]+|[ivxlcdm]+)\b", re.I)
+_BARE_NUM = re.compile(r"^\s*([0-9]+|[ivxlcdm]+)\s*[.:]?\s*$", re.I)
+_CANONICAL_ROMAN = re.compile(r"^M{0,3}(CM|CD|D?C{0,3})(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})$", re.I)
+_ROMAN = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100, "d": 500, "m": 1000}
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+              "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+def chapter_number(title, bare=True):
+    """
+    Parse the chapter number from a title.
+    Args:
+        title: str. Chapter title or first line of the chapter.
+        bare: bool. Also accept a title that is only a number ("12.", "XII").
+            Only safe for table-of-contents titles; a first line of text
+            such as "Did." or "Mix" would otherwise be read as a numeral.
+    Returns:
+        number: int, or None if the title carries no chapter number.
+    """
+    if not title:
+        return None
+    m = _ZH_NUM.search(title) or _EN_NUM.match(title) or (bare and _BARE_NUM.match(title))
+    if not m:
+        return None
+    token = m.group(1)
+    if token.isdigit():
+        return int(token)
+    if token[0] in _CN_DIGITS or token[0] in _CN_UNITS:
+        return _cn_to_int(token)
+    if not (token.isupper() or token.islower()) or not _CANONICAL_ROMAN.match(token):
+        return None     # "Mix", "IIII", "VX" are words or malformed, not numerals
+    return _roman_to_int(token.lower())
+
+def _roman_to_int(token):
+    total = 0
+    for k, ch in enumerate(token):
+        value = _ROMAN[ch]
+        if k + 1 < len(token) and _ROMAN[token[k + 1]] > value:
+            total -= value
+        else:
+            total += value
+    return total
+
+def _cn_to_int(token):
+    total, digit = 0, 0
+    for ch in token:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        else:
+            total += (digit or 1) * _CN_UNITS[ch]
+            digit = 0
+    return total + digit
+
+def chapter_vectors(sent_vecs, bounds):
+    """
+    Sum the sentence embeddings of every chapter.
+    Args:
+        sent_vecs: numpy array of shape (num_sents, embedding_size).
+        bounds: list of (start, end) sentence ranges, one per chapter.
+    Returns:
+        vecs: numpy array of shape (num_chapters, embedding_size).
+    """
+    vecs = np.zeros((len(bounds), sent_vecs.shape[1]), dtype=np.float32)
+    for k, (start, end) in enumerate(bounds):
+        if end > start:
+            vecs[k] = sent_vecs[start:end].sum(axis=0)
+    return vecs
+
+def _chapter_numbers(titles, toc, n):
+    if not titles:
+        return [None] * n
+    if toc is None:
+        toc = [True] * len(titles)
+    return [chapter_number(t, bare=b) for t, b in zip(titles, toc)]
+
+def match_chapters(src_vecs, tgt_vecs, src_lens, tgt_lens,
+                   src_titles=None, tgt_titles=None, skip=-0.1, title_weight=0.2,
+                   src_toc=None, tgt_toc=None):
+    """
+    Pair chapters across languages with a monotonic DP.
+    Args:
+        src_vecs: numpy array of shape (num_src_chapters, embedding_size),
+            summed sentence embeddings (see chapter_vectors).
+        tgt_vecs: numpy array of shape (num_tgt_chapters, embedding_size).
+        src_lens: sequence of source chapter lengths in characters.
+        tgt_lens: sequence of target chapter lengths in characters.
+        src_titles/tgt_titles: chapter titles, used for chapter numbers.
+        skip: float. Score of leaving a chapter unmatched.
+        title_weight: float. Added when both chapter numbers agree,
+            subtracted when both are known and differ.
+        src_toc/tgt_toc: per-chapter flags, True when the title comes from
+            the table of contents (see chapter_number's bare). Default: all
+            titles are trusted.
+    Returns:
+        beads: list of (src_chapters, tgt_chapters) index lists of the
+            matched chapters, in book order; unmatched chapters are left out.
+    """
+    src_n, tgt_n = len(src_vecs), len(tgt_vecs)
+    src_lens = np.asarray(src_lens, dtype=np.float64)
+    tgt_lens = np.asarray(tgt_lens, dtype=np.float64)
+    char_ratio = src_lens.sum() / max(tgt_lens.sum(), 1.0)
+    src_nums = _chapter_numbers(src_titles, src_toc, src_n)
+    tgt_nums = _chapter_numbers(tgt_titles, tgt_toc, tgt_n)
+
+    def bead_score(i, j, a_1, a_2):
+        # chapters i-a_1..i-1 against j-a_2..j-1
+        src_v = src_vecs[i - a_1:i].sum(axis=0)
+        tgt_v = tgt_vecs[j - a_2:j].sum(axis=0)
+        norm = np.linalg.norm(src_v) * np.linalg.norm(tgt_v)
+        similarity = float(src_v @ tgt_v / norm) if norm > 0 else 0.0
+        src_num, tgt_num = src_nums[i - a_1], tgt_nums[j - a_2]
+        if src_num is not None and tgt_num is not None:
+            similarity += title_weight if src_num == tgt_num else -title_weight
+        src_l = src_lens[i - a_1:i].sum()
+        tgt_l = tgt_lens[j - a_2:j].sum() * char_ratio
+        if max(src_l, tgt_l) == 0:
+            return similarity
+        return similarity * np.log2(1 + min(src_l, tgt_l) / max(src_l, tgt_l))
+
+    cost = np.full((src_n + 1, tgt_n + 1), -np.inf)
+    pointers = np.zeros((src_n + 1, tgt_n + 1), dtype=np.int8)
+    cost[0, 0] = 0
+    for i in range(src_n + 1):
+        for j in range(tgt_n + 1):
+            for a, (a_1, a_2) in enumerate(CHAPTER_TYPES):
+                if i < a_1 or j < a_2 or cost[i - a_1, j - a_2] == -np.inf:
+                    continue
+                if a_1 == 0 or a_2 == 0:
+                    score = cost[i - a_1, j - a_2] + skip
+                else:
+                    score = cost[i - a_1, j - a_2] + bead_score(i, j, a_1, a_2)
+                if score > cost[i, j]:
+                    cost[i, j] = score
+                    pointers[i, j] = a
+
+    beads = []
+    i, j = src_n, tgt_n
+    while i > 0 or j > 0:
+        a_1, a_2 = CHAPTER_TYPES[pointers[i, j]]
+        if a_1 and a_2:
+            beads.append((list(range(i - a_1, i)), list(range(j - a_2, j))))
+        i, j = i - a_1, j - a_2
+    return beads[::-1]
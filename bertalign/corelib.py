@@ -21,7 +21,65 @@ def second_back_track(i, j, pointers, search_path, a_types):
         if i == 0 and j == 0:
             return alignment[::-1]
 
-@nb.jit(nopython=True, fastmath=True, cache=True)
+# Per-bead confidence: the terms the second-pass DP added for each bead.
+BEAD_SCORE_DTYPE = np.dtype([("similarity", np.float32),      # cosine of the two segment embeddings
+                             ("margin", np.float32),          # neighbour similarity subtracted (0 without margin)
+                             ("length_penalty", np.float32),  # length factor applied (1 without len_penalty)
+                             ("score", np.float32)])          # (similarity - margin) * length_penalty, or skip
+
+def bead_scores(alignment, src_vecs, tgt_vecs, src_lens, tgt_lens,
+                char_ratio, skip, margin=False, len_penalty=False):
+    """
+    Recover the DP score terms of every bead returned by second_back_track.
+    Args:
+        alignment: list of (src_range, tgt_range) beads.
+        Other args: as for second_pass_align.
+    Returns:
+        scores: structured numpy array of BEAD_SCORE_DTYPE, one row per bead.
+            The scores sum to the cost of the best DP path.
+    """
+    beads = np.zeros((len(alignment), 4), dtype=np.int64)
+    for k, (src_range, tgt_range) in enumerate(alignment):
+        beads[k, 0] = src_range[-1] + 1 if src_range else 0
+        beads[k, 1] = tgt_range[-1] + 1 if tgt_range else 0
+        beads[k, 2] = len(src_range)
+        beads[k, 3] = len(tgt_range)
+    terms = _bead_terms(src_vecs, tgt_vecs, src_lens, tgt_lens, beads,
+                        char_ratio, skip, margin, len_penalty)
+    scores = np.zeros(len(alignment), dtype=BEAD_SCORE_DTYPE)
+    for col, name in enumerate(BEAD_SCORE_DTYPE.names):
+        scores[name] = terms[:, col]
+    return scores
+
+@nb.jit(nopython=True, nogil=True, fastmath=True, cache=True)
+def _bead_terms(src_vecs, tgt_vecs, src_lens, tgt_lens, beads,
+                char_ratio, skip, margin, len_penalty):
+    src_len = src_vecs.shape[1]
+    tgt_len = tgt_vecs.shape[1]
+    terms = np.zeros((beads.shape[0], 4), dtype=np.float32)
+    for k in range(beads.shape[0]):
+        i, j, a_1, a_2 = beads[k, 0], beads[k, 1], beads[k, 2], beads[k, 3]
+        if a_1 == 0 or a_2 == 0:  # deletion or insertion
+            terms[k, 2] = 1.0
+            terms[k, 3] = skip
+            continue
+        src_v = src_vecs[a_1 - 1, i - 1, :]
+        tgt_v = tgt_vecs[a_2 - 1, j - 1, :]
+        similarity = nb_dot(src_v, tgt_v)
+        neighbor_ave_sim = 0.0
+        if margin:
+            neighbor_ave_sim = (calculate_neighbor_similarity(src_v, a_2, j, tgt_len, tgt_vecs) +
+                                calculate_neighbor_similarity(tgt_v, a_1, i, src_len, src_vecs)) / 2
+        penalty = 1.0
+        if len_penalty:
+            penalty = calculate_length_penalty(src_lens, tgt_lens, i, j, a_1, a_2, char_ratio)
+        terms[k, 0] = similarity
+        terms[k, 1] = neighbor_ave_sim
+        terms[k, 2] = penalty
+        terms[k, 3] = (similarity - neighbor_ave_sim) * penalty
+    return terms
+
+@nb.jit(nopython=True, nogil=True, fastmath=True, cache=True)
 def second_pass_align(src_vecs,
                       tgt_vecs,
                       src_lens,
@@ -266,7 +324,7 @@ def first_back_track(i, j, pointers, search_path, a_types):
         if i == 0 and j == 0: # if reaching the origin
             return alignment[::-1]
 
-@nb.jit(nopython=True, fastmath=True, cache=True)
+@nb.jit(nopython=True, nogil=True, fastmath=True, cache=True)
 def first_pass_align(src_len,
                      tgt_len,
                      w,
@@ -1,19 +1,197 @@
+import atexit
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
 import numpy as np
+import torch
 
 from sentence_transformers import SentenceTransformer
 from bertalign.utils import yield_overlaps
 
+# torch: full-precision PyTorch model (default)
+# quantized: PyTorch model with int8 dynamically quantized Linear layers (CPU only)
+# onnx: ONNX Runtime execution via sentence-transformers' onnx backend (CPU only)
+BACKENDS = ("torch", "quantized", "onnx")
+
+def load_sentence_model(model_name, backend="torch"):
+    """Load a SentenceTransformer for the given inference backend."""
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "quantized":
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    raise ValueError("Unknown encoder backend {}, expected one of {}".format(backend, BACKENDS))
+
+def _attach(name):
+    """Attach to a SharedMemory block owned by another process without tracking it here."""
+    try:
+        return SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        shm = SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _pool_worker(model_name, backend, num_threads, tasks, done):
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    if backend == "torch":
+        model = SentenceTransformer(model_name, device="cpu")
+    else:
+        model = load_sentence_model(model_name, backend)
+    dim = model.get_sentence_embedding_dimension()
+    done.put(("ready", dim, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job, shm_name, num_rows, start, sents = task
+        shm = out = None
+        try:
+            shm = _attach(shm_name)
+            out = np.ndarray((num_rows, dim), dtype=np.float32, buffer=shm.buf)
+            out[start:start + len(sents)] = model.encode(sents, batch_size=len(sents))
+            done.put((job, start, None))
+        except Exception as e:
+            done.put((job, start, repr(e)))
+        finally:
+            out = None      # release the view of shm.buf before closing it
+            if shm is not None:
+                shm.close()
+
+_POLL_SECONDS = 1.0     # how often a waiting EncoderPool checks that its workers are alive
+_CLOSE_TIMEOUT = 10.0   # seconds close() waits for a worker before terminating it
+
+class EncoderPool:
+    """
+    Persistent CPU worker processes for SentenceTransformer.encode.
+
+    Each worker loads the model once and runs with a fixed number of torch
+    threads. Sentences are sent in chunks; embeddings are written by the
+    workers straight into a shared-memory output array, so no embedding
+    matrix is pickled back. Use get_pool() to share one pool per
+    (model, backend, workers, threads) across Encoders and Bertalign runs.
+    """
+
+    def __init__(self, model_name, backend="torch", num_workers=2, threads_per_worker=None, chunk_size=128):
+        ctx = mp.get_context("spawn")
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.chunk_size = chunk_size
+        self._tasks = ctx.Queue()
+        self._done = ctx.Queue()
+        self._jobs = itertools.count()
+        self._lock = threading.Lock()       # one job in flight; results are matched by job id
+        self._procs = [ctx.Process(target=_pool_worker,
+                                   args=(model_name, backend, self.threads_per_worker, self._tasks, self._done),
+                                   daemon=True)
+                       for _ in range(num_workers)]
+        for proc in self._procs:
+            proc.start()
+        dims = {self._get_done()[1] for _ in self._procs}
+        self.dim = dims.pop()
+
+    def _get_done(self):
+        """Next worker message; raises instead of waiting forever when a worker has died."""
+        while True:
+            try:
+                return self._done.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                dead = [p for p in self._procs if p.exitcode is not None]
+                if dead or not self._procs:
+                    self._terminate()
+                    raise RuntimeError("Encoder worker died: " + ", ".join(
+                        "pid {} exit code {}".format(p.pid, p.exitcode) for p in dead))
+
+    def _terminate(self):
+        for proc in self._procs:
+            if proc.exitcode is None:
+                proc.terminate()
+            proc.join()
+        self._procs = []
+
+    def encode(self, sents):
+        num_rows = len(sents)
+        if num_rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        with self._lock:
+            return self._run_job(next(self._jobs), sents, num_rows)
+
+    def _run_job(self, job, sents, num_rows):
+        shm = SharedMemory(create=True, size=num_rows * self.dim * 4)
+        try:
+            starts = range(0, num_rows, self.chunk_size)
+            for start in starts:
+                self._tasks.put((job, shm.name, num_rows, start, list(sents[start:start + self.chunk_size])))
+            errors = []
+            for _ in starts:
+                done_job, start, error = self._get_done()
+                if done_job != job:
+                    raise RuntimeError("Encoder pool out of sync: got result for job {}".format(done_job))
+                if error is not None:
+                    errors.append("chunk {}: {}".format(start, error))
+            if errors:
+                raise RuntimeError("Encoding failed in worker: " + "; ".join(errors))
+            return np.ndarray((num_rows, self.dim), dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=_CLOSE_TIMEOUT)
+        self._terminate()
+
+_POOLS = {}
+
+def get_pool(model_name, backend="torch", num_workers=2, threads_per_worker=None):
+    """Return the process-wide EncoderPool for this configuration, starting it on first use."""
+    key = (model_name, backend, num_workers, threads_per_worker)
+    if key not in _POOLS or not _POOLS[key]._procs:    # restart a pool whose workers died
+        _POOLS[key] = EncoderPool(model_name, backend, num_workers, threads_per_worker)
+    return _POOLS[key]
+
+@atexit.register
+def _close_pools():
+    for pool in _POOLS.values():
+        pool.close()
+    _POOLS.clear()
+
 class Encoder:
-    def __init__(self, model_name):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name, backend="torch", num_workers=0, threads_per_worker=None):
+        """
+        num_workers: 0 encodes in this process; > 0 encodes through a shared
+            EncoderPool of that many processes (started on first use).
+        """
         self.model_name = model_name
+        self.backend = backend
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.model = load_sentence_model(model_name, backend) if num_workers <= 0 else None
+
+    def _encode(self, overlaps):
+        if self.num_workers > 0:
+            pool = get_pool(self.model_name, self.backend, self.num_workers, self.threads_per_worker)
+            return pool.encode(overlaps)
+        return self.model.encode(overlaps)
 
     def transform(self, sents, num_overlaps):
         overlaps = []
         for line in yield_overlaps(sents, num_overlaps):
             overlaps.append(line)
 
-        sent_vecs = self.model.encode(overlaps)
+        sent_vecs = self._encode(overlaps)
         embedding_dim = sent_vecs.size // (len(sents) * num_overlaps)
         sent_vecs.resize(num_overlaps, len(sents), embedding_dim)
 
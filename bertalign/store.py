@@ -0,0 +1,105 @@
+"""
+Compact sentence storage.
+
+A SentenceStore keeps every sentence in one UTF-8 buffer plus an int64
+offsets array (sentence i is data[offsets[i]:offsets[i+1]]) instead of one
+Python str object per sentence. It is a read-only Sequence of str, so it can
+be passed wherever a sentence list is read: indexing (also with numpy
+integers) and iteration decode on access, and slicing returns a plain list
+of the selected sentences, so batching code keeps working unchanged.
+
+A saved store is opened memory-mapped; pickling an opened store only sends
+its path, so worker processes map the same read-only pages instead of
+receiving a copy.
+"""
+
+import operator
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+
+class SentenceStore(Sequence):
+    def __init__(self, data, offsets, path=None):
+        self._data = data
+        self._view = memoryview(data)
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self.path = path
+
+    @classmethod
+    def from_list(cls, sents):
+        """Build a store from any iterable of str, consumed one sentence at a time."""
+        buf = bytearray()
+        offsets = [0]
+        for s in sents:
+            buf += s.encode("utf-8")
+            offsets.append(len(buf))
+        return cls(buf, offsets)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a store written by save()."""
+        path = str(path)
+        offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+        data = b""
+        if offsets[-1] > 0:
+            data = np.memmap(path + ".bin", dtype=np.uint8, mode="r")
+        return cls(data, offsets, path=path)
+
+    def save(self, path):
+        """Write <path>.bin (UTF-8 text) and <path>.offsets.npy."""
+        path = str(path)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        start, end = int(self._offsets[0]), int(self._offsets[-1])
+        with open(path + ".bin", "wb") as f:
+            f.write(self._view[start:end])
+        np.save(path + ".offsets.npy", self._offsets - start)
+
+    def view(self, start, stop):
+        """Zero-copy store of sentences start..stop-1."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return SentenceStore(self._data, self._offsets[start:max(start, stop) + 1], path=None)
+
+    def byte_lengths(self):
+        return np.diff(self._offsets)
+
+    @property
+    def nbytes(self):
+        return int(self._offsets[-1] - self._offsets[0]) + self._offsets.nbytes
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._get(i) for i in range(*idx.indices(len(self)))]
+        i = operator.index(idx)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("SentenceStore index out of range")
+        return self._get(i)
+
+    def _get(self, i):
+        return str(self._view[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def __iter__(self):
+        view, offsets = self._view, self._offsets.tolist()
+        for a, b in zip(offsets, offsets[1:]):
+            yield str(view[a:b], "utf-8")
+
+    def __getstate__(self):
+        if self.path is not None:
+            return {"path": self.path}
+        start, end = int(self._offsets[0]), int(self._offsets[-1])
+        return {"data": bytes(self._view[start:end]), "offsets": self._offsets - start}
+
+    def __setstate__(self, state):
+        if "path" in state:
+            other = SentenceStore.open(state["path"])
+            state = {"data": other._data, "offsets": other._offsets, "path": other.path}
+        self.__init__(state["data"], state["offsets"], state.get("path"))
+
+    def __repr__(self):
+        return f"SentenceStore({len(self)} sentences, {self.nbytes} bytes)"
@@ -0,0 +1,138 @@
+"""
+Alignment parameter sweep.
+
+Every document is encoded once, at the largest max_align of the grid, and
+each grid point only reruns the DP through Bertalign.align(**point), which
+leaves the aligner untouched. Points run on a thread pool (the DP kernels
+release the GIL) and are scored against gold alignments with
+bertalign.eval.score_multiple.
+
+The first-pass faiss search only depends on top_k and is cached on the
+aligner, so it is run for every top_k of the grid before any point is timed
+and reported on its own (search_seconds, wall clock: faiss uses its own
+OpenMP threads). dp_cpu_seconds is the CPU time of the thread that ran the
+point's DP, so it does not depend on how many points run at once.
+
+Usage:
+  python -m bertalign.sweep --src doc1.en doc2.en --tgt doc1.zh doc2.zh \
+      --gold doc1.gold doc2.gold --is-split \
+      --grid skip=-0.1,-0.2,-0.3 --grid max_align=3,5 --grid margin=true,false \
+      [--workers 4] [--out sweep.jsonl]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bertalign.aligner import Bertalign
+from bertalign.eval import read_alignments, score_multiple
+
+_TYPES = {"max_align": int, "top_k": int, "win": int, "skip": float,
+          "margin": lambda v: v.lower() in ("1", "true", "yes"),
+          "len_penalty": lambda v: v.lower() in ("1", "true", "yes")}
+
+def parse_grid(specs):
+    """
+    Parse ["skip=-0.1,-0.2", "margin=true,false"] into {name: [values]}.
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        if name not in _TYPES:
+            raise ValueError("Unknown sweep parameter {}, expected one of {}".format(name, ", ".join(_TYPES)))
+        grid[name] = [_TYPES[name](v.strip()) for v in values.split(",") if v.strip()]
+    return grid
+
+def grid_points(grid):
+    """All combinations of a {name: [values]} grid, as override dicts."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def run_sweep(aligners, golds, points, workers=None):
+    """
+    Align every document for every grid point and score it against gold.
+    Args:
+        aligners: list of Bertalign objects, already encoded.
+        golds: list of gold alignments (bertalign.eval format), one per aligner.
+        points: list of override dicts for Bertalign.align.
+        workers: int. Grid points run concurrently.
+    Returns:
+        rows: one dict per point with the parameters, the score_multiple
+            metrics, dp_cpu_seconds (CPU time of its DP, after the search
+            was cached) and search_seconds (wall time of the top_k search
+            it uses), both summed over documents.
+    """
+    search_seconds = {}
+    for k in sorted({point.get("top_k") for point in points}, key=str):
+        start = time.perf_counter()
+        for aligner in aligners:
+            aligner._top_k(aligner.top_k if k is None else k)
+        search_seconds[k] = time.perf_counter() - start
+
+    def run(point):
+        start = time.thread_time()
+        results = [aligner.align(**point)[0] for aligner in aligners]
+        seconds = time.thread_time() - start
+        return {**point, **score_multiple(gold_list=golds, test_list=results),
+                "dp_cpu_seconds": seconds, "search_seconds": search_seconds[point.get("top_k")]}
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        return list(pool.map(run, points))
+
+def _print_table(rows, names):
+    header = names + ["f1_strict", "f1_lax", "dp_cpu_s", "search_s"]
+    print(" | ".join("{:>11}".format(h) for h in header))
+    for row in sorted(rows, key=lambda r: -r["f1_strict"]):
+        cells = [str(row[n]) for n in names] + ["{:.3f}".format(row["f1_strict"]),
+                                                "{:.3f}".format(row["f1_lax"]),
+                                                "{:.2f}".format(row["dp_cpu_seconds"]),
+                                                "{:.2f}".format(row["search_seconds"])]
+        print(" | ".join("{:>11}".format(c) for c in cells))
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Bertalign parameters against gold alignments")
+    parser.add_argument("--src", nargs="+", required=True, help="source documents")
+    parser.add_argument("--tgt", nargs="+", required=True, help="target documents, one per source")
+    parser.add_argument("--gold", nargs="+", required=True, help="gold alignment files, one per source")
+    parser.add_argument("--src-lang", default="en")
+    parser.add_argument("--tgt-lang", default="zh")
+    parser.add_argument("--is-split", action="store_true", help="documents hold one sentence per line")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="name=v1,v2,... for max_align, top_k, win, skip, margin, len_penalty; repeatable")
+    parser.add_argument("--workers", type=int, default=None, help="grid points aligned concurrently")
+    parser.add_argument("--out", help="write one JSON line per grid point")
+    args = parser.parse_args()
+    if not len(args.src) == len(args.tgt) == len(args.gold):
+        parser.error("--src, --tgt and --gold need the same number of files")
+
+    grid = parse_grid(args.grid)
+    points = grid_points(grid)
+    depth = max(grid.get("max_align", [5]))
+
+    aligners, golds = [], []
+    for src_path, tgt_path, gold_path in zip(args.src, args.tgt, args.gold):
+        with open(src_path, encoding="utf-8") as f:
+            src = f.read()
+        with open(tgt_path, encoding="utf-8") as f:
+            tgt = f.read()
+        aligners.append(Bertalign(src, tgt, max_align=depth, is_split=args.is_split,
+                                  src_lang=args.src_lang, tgt_lang=args.tgt_lang))
+        golds.append(read_alignments(gold_path))
+
+    print("Sweeping {} grid points over {} documents ...".format(len(points), len(aligners)))
+    start = time.perf_counter()
+    rows = run_sweep(aligners, golds, points, args.workers)
+    print("Sweep finished in {:.2f}s\n".format(time.perf_counter() - start))
+    _print_table(rows, list(grid))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+if __name__ == "__main__":
+    main()
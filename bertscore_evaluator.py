@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+BERTScore翻译质量评估器
+
+translation_evaluator.py 和 BERTScore/translation_evaluator.py 两个命令行
+共用此模块: 长度排序的批量评分、参考译文词向量缓存、长文本分段评分和速度档位。
+"""
+
+import torch
+import numpy as np
+from bert_score import BERTScorer
+from bert_score.utils import get_bert_embedding, greedy_cos_idf
+from torch.nn.utils.rnn import pad_sequence
+from collections import OrderedDict, defaultdict
+import hashlib
+import math
+import re
+import os
+
+# 长文本分段: 句末标点后切分(仅用于窗口模式，作为候选切分点)
+_SENT_END_RE = re.compile(r"(?<=[。！？；!?.…])\s*")
+
+def _split_sentences(text):
+    return [s for s in _SENT_END_RE.split(text.replace("\n", " ")) if s.strip()]
+
+def _window_segments(zh_sents, en_sents, segment_chars):
+    """按累计字符比例在两侧同时切分，得到大致对应的片段对"""
+    zh_cum = np.cumsum([len(s) for s in zh_sents])
+    en_cum = np.cumsum([len(s) for s in en_sents])
+    k = max(1, math.ceil(zh_cum[-1] / segment_chars))
+    zh_cuts, en_cuts = [0], [0]
+    for i in range(1, k):
+        frac = i / k
+        zh_cuts.append(max(zh_cuts[-1], int(np.argmin(np.abs(zh_cum - frac * zh_cum[-1]))) + 1))
+        en_cuts.append(max(en_cuts[-1], int(np.argmin(np.abs(en_cum - frac * en_cum[-1]))) + 1))
+    zh_cuts.append(len(zh_sents))
+    en_cuts.append(len(en_sents))
+    return [("".join(zh_sents[a:b]), " ".join(en_sents[c:d]))
+            for a, b, c, d in zip(zh_cuts, zh_cuts[1:], en_cuts, en_cuts[1:]) if b > a or d > c]
+
+def _bead_segments(aligner, segment_chars):
+    """把Bertalign的对齐结果按顺序合并成不超过segment_chars的片段对"""
+    segments, zh_buf, en_buf = [], [], []
+    for zh_ids, en_ids in aligner.result:
+        zh_part = "".join(aligner.src_sents[i] for i in zh_ids)
+        en_part = " ".join(aligner.tgt_sents[i] for i in en_ids)
+        # 空侧(1-0 / 0-1)的句子并入当前片段，不单独成段
+        if zh_buf and zh_ids and en_ids and len("".join(zh_buf)) + len(zh_part) > segment_chars:
+            segments.append(("".join(zh_buf), " ".join(en_buf)))
+            zh_buf, en_buf = [], []
+        if zh_part:
+            zh_buf.append(zh_part)
+        if en_part:
+            en_buf.append(en_part)
+    if zh_buf or en_buf:
+        segments.append(("".join(zh_buf), " ".join(en_buf)))
+    return segments
+
+# 速度/精度档位: accurate 为完整模型; fast 截断层数并int8量化; fastest 换用更小的多语言模型
+TIERS = {
+    "accurate": {"model_type": "bert-base-multilingual-cased", "num_layers": None, "quantize": False},
+    "fast": {"model_type": "bert-base-multilingual-cased", "num_layers": 6, "quantize": True},
+    "fastest": {"model_type": "distilbert-base-multilingual-cased", "num_layers": 3, "quantize": True},
+}
+
+class TranslationEvaluator:
+    def __init__(self, model_type=None, ref_cache_size=0, ref_cache_dir=None,
+                 tier="accurate", num_layers=None, quantize=None, rescale_with_baseline=True):
+        """
+        初始化BERTScore评估器
+        
+        参数:
+            model_type: 使用的预训练模型，默认由tier决定(accurate为支持多语言的BERT模型)
+            ref_cache_size: 内存中缓存的参考译文(中文)词向量条数，0表示不缓存
+            ref_cache_dir: 缓存溢出目录，LRU淘汰的词向量保存到磁盘以便复用
+            tier: 速度/精度档位 "accurate" / "fast" / "fastest"，见TIERS
+            num_layers: 使用的模型层数(更深的层被截断)，默认由tier决定
+            quantize: 是否对线性层做int8动态量化(仅CPU)，默认由tier决定
+            rescale_with_baseline: 是否用BERTScore基线文件重新缩放分数
+        """
+        if tier not in TIERS:
+            raise ValueError(f"未知的档位: {tier}")
+        settings = TIERS[tier]
+        model_type = model_type or settings["model_type"]
+        num_layers = settings["num_layers"] if num_layers is None else num_layers
+        quantize = settings["quantize"] if quantize is None else quantize
+
+        self.model_type = model_type
+        self.tier = tier
+        # 模型标识(模型/层数/精度)，用于缓存键
+        self.model_id = f"{model_type}:L{num_layers or 'default'}:{'int8' if quantize else 'fp32'}"
+        self.ref_cache_size = ref_cache_size
+        self.ref_cache_dir = ref_cache_dir
+        self._ref_cache = OrderedDict()  # 文本哈希 -> (embedding, idf)
+        if ref_cache_dir:
+            os.makedirs(ref_cache_dir, exist_ok=True)
+        print("正在加载BERT模型，这可能需要一些时间...")
+        self.scorer = BERTScorer(
+            model_type=model_type,
+            num_layers=num_layers,
+            lang="zh-en",  # 支持中英文
+            rescale_with_baseline=rescale_with_baseline,
+            device="cuda" if torch.cuda.is_available() and not quantize else "cpu"
+        )
+        if quantize:
+            # 动态量化只支持CPU推理
+            self.scorer._model = torch.quantization.quantize_dynamic(
+                self.scorer._model, {torch.nn.Linear}, dtype=torch.qint8)
+        print(f"模型已加载，运行于 {self.scorer.device}")
+        
+    def evaluate(self, chinese_text, english_text):
+        """
+        评估中英文翻译质量
+        
+        参数:
+            chinese_text: 中文文本(源文本或参考翻译)
+            english_text: 英文文本(待评估的翻译)
+            
+        返回:
+            dict: 包含P(精确度)、R(召回率)和F1评分
+        """
+        # 将文本转换为列表格式
+        refs = [chinese_text]
+        cands = [english_text]
+        
+        # 计算BERTScore分数
+        P, R, F1 = self._score(cands, refs, self.scorer.batch_size)
+        
+        # 转换为numpy数组便于处理
+        P_np = P.cpu().numpy()
+        R_np = R.cpu().numpy()
+        F1_np = F1.cpu().numpy()
+        
+        return {
+            "precision": float(P_np[0]),  # 精确度
+            "recall": float(R_np[0]),     # 召回率
+            "f1": float(F1_np[0]),        # F1分数
+            "normalized_f1": (float(F1_np[0]) + 1) / 2  # 归一化到0-1范围
+        }
+    
+    def evaluate_batch(self, chinese_texts, english_texts, batch_size=64, chunk_size=4096):
+        """
+        批量评估多对中英文翻译质量
+
+        按长度排序后分块调用BERTScore，减少padding并避免逐对前向计算。
+
+        参数:
+            chinese_texts: 中文文本列表(参考)
+            english_texts: 英文文本列表(待评估的翻译)
+            batch_size: 每次前向计算的句对数量
+            chunk_size: 每次交给BERTScorer.score的句对数量(控制内存)
+
+        返回:
+            dict: "precision"、"recall"、"f1" 三个numpy数组，顺序与输入一致
+        """
+        if len(chinese_texts) != len(english_texts):
+            raise ValueError("中文与英文文本数量必须一致")
+
+        n = len(chinese_texts)
+        P_all = np.zeros(n, dtype=np.float32)
+        R_all = np.zeros(n, dtype=np.float32)
+        F1_all = np.zeros(n, dtype=np.float32)
+
+        # 按长度排序，使同一批次内的句子长度相近
+        order = np.argsort([len(zh) + len(en) for zh, en in zip(chinese_texts, english_texts)], kind="stable")
+        for start in range(0, n, chunk_size):
+            idx = order[start:start + chunk_size]
+            refs = [chinese_texts[i] for i in idx]
+            cands = [english_texts[i] for i in idx]
+            P, R, F1 = self._score(cands, refs, batch_size)
+            P_all[idx] = P.cpu().numpy()
+            R_all[idx] = R.cpu().numpy()
+            F1_all[idx] = F1.cpu().numpy()
+
+        return {"precision": P_all, "recall": R_all, "f1": F1_all}
+
+    def _score(self, cands, refs, batch_size):
+        """启用参考译文缓存时走缓存路径，否则直接调用BERTScorer.score"""
+        if self.ref_cache_size or self.ref_cache_dir:
+            return self._score_cached(cands, refs, batch_size)
+        return self.scorer.score(cands, refs, batch_size=batch_size)
+
+    def _ref_key(self, text):
+        return hashlib.blake2b(f"{self.model_id}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def _cache_get(self, key):
+        item = self._ref_cache.get(key)
+        if item is not None:
+            self._ref_cache.move_to_end(key)
+            return item
+        if self.ref_cache_dir:
+            path = os.path.join(self.ref_cache_dir, key + ".pt")
+            if os.path.exists(path):
+                # 溢出文件只含张量，weights_only避免反序列化任意对象
+                item = torch.load(path, map_location="cpu", weights_only=True)
+                self._cache_put(key, item)
+                return item
+        return None
+
+    def _cache_put(self, key, item):
+        self._ref_cache[key] = item
+        self._ref_cache.move_to_end(key)
+        while len(self._ref_cache) > self.ref_cache_size:
+            old_key, old_item = self._ref_cache.popitem(last=False)
+            if self.ref_cache_dir:
+                path = os.path.join(self.ref_cache_dir, old_key + ".pt")
+                if not os.path.exists(path):
+                    torch.save(old_item, path)
+
+    def _encode(self, texts, batch_size):
+        """编码文本，返回每条文本去除padding后的(embedding, idf)"""
+        tokenizer = self.scorer._tokenizer
+        if self.scorer.idf:
+            idf_dict = self.scorer._idf_dict
+        else:
+            idf_dict = defaultdict(lambda: 1.0)
+            idf_dict[tokenizer.sep_token_id] = 0
+            idf_dict[tokenizer.cls_token_id] = 0
+
+        items = []
+        for start in range(0, len(texts), batch_size):
+            emb, mask, idf = get_bert_embedding(texts[start:start + batch_size], self.scorer._model, tokenizer,
+                                                idf_dict, device=self.scorer.device,
+                                                all_layers=self.scorer.all_layers)
+            for j, n in enumerate(mask.sum(dim=1).tolist()):
+                items.append((emb[j, :n].cpu().clone(), idf[j, :n].cpu().clone()))
+        return items
+
+    def _score_cached(self, cands, refs, batch_size):
+        """参考译文的词向量只编码一次并缓存，候选译文每次重新编码"""
+        keys = [self._ref_key(text) for text in refs]
+        ref_items, missing = {}, []
+        for key, text in zip(keys, refs):
+            if key not in ref_items:
+                ref_items[key] = self._cache_get(key)
+                if ref_items[key] is None:
+                    missing.append((key, text))
+        for (key, _), item in zip(missing, self._encode([text for _, text in missing], batch_size)):
+            ref_items[key] = item
+            self._cache_put(key, item)
+
+        hyp_items = self._encode(cands, batch_size)
+        preds = []
+        for start in range(0, len(cands), batch_size):
+            ref_batch = [ref_items[key] for key in keys[start:start + batch_size]]
+            preds.append(self._greedy_match(ref_batch, hyp_items[start:start + batch_size]))
+        preds = torch.cat(preds)
+
+        if self.scorer.rescale_with_baseline:
+            preds = (preds - self.scorer.baseline_vals) / (1 - self.scorer.baseline_vals)
+        return preds[..., 0], preds[..., 1], preds[..., 2]
+
+    def _greedy_match(self, ref_batch, hyp_batch):
+        """对一批(embedding, idf)做BERTScore贪心匹配，返回[P, R, F1]"""
+        device = self.scorer.device
+
+        def pad(items):
+            emb = pad_sequence([e for e, _ in items], batch_first=True).to(device)
+            idf = pad_sequence([w for _, w in items], batch_first=True).to(device)
+            lens = torch.tensor([len(w) for _, w in items])
+            mask = (torch.arange(idf.size(1))[None, :] < lens[:, None]).long().to(device)
+            return emb, mask, idf
+
+        with torch.no_grad():
+            P, R, F1 = greedy_cos_idf(*pad(ref_batch), *pad(hyp_batch), self.scorer.all_layers)
+        return torch.stack((P, R, F1), dim=-1).cpu()
+
+    def evaluate_long(self, chinese_text, english_text, align="window", segment_chars=300, batch_size=64):
+        """
+        长文本(整章)翻译质量评估
+
+        BERT模型只能处理512个token，整章文本直接评估会被截断。
+        此方法先分段并对齐两侧片段，批量评分后按长度加权汇总。
+
+        参数:
+            chinese_text: 中文文本(参考)
+            english_text: 英文文本(待评估的翻译)
+            align: "window" 按字符比例切分窗口; "bertalign" 用句向量对齐句子
+            segment_chars: 每个中文片段的最大字符数
+            batch_size: 每次前向计算的片段对数量
+
+        返回:
+            dict: 与evaluate相同的字段，另含片段数量"segments"
+        """
+        if align == "bertalign":
+            try:
+                from bertalign import Bertalign
+            except ImportError as e:
+                raise ImportError("bertalign对齐需要在仓库根目录运行(可导入bertalign包)") from e
+            aligner = Bertalign(chinese_text, english_text, src_lang="zh", tgt_lang="en")
+            aligner.align_sents()
+            segments = _bead_segments(aligner, segment_chars)
+        elif align == "window":
+            zh_sents = _split_sentences(chinese_text)
+            en_sents = _split_sentences(english_text)
+            if not zh_sents or not en_sents:
+                return self.evaluate(chinese_text, english_text)
+            segments = _window_segments(zh_sents, en_sents, segment_chars)
+        else:
+            raise ValueError(f"未知的对齐方式: {align}")
+
+        scores = self.evaluate_batch([zh for zh, _ in segments], [en for _, en in segments],
+                                     batch_size=batch_size)
+
+        # 精确度按译文长度加权，召回率按参考长度加权，F1按两者之和加权
+        zh_len = np.array([len(zh) for zh, _ in segments], dtype=np.float64)
+        en_len = np.array([len(en) for _, en in segments], dtype=np.float64)
+        precision = float(np.sum(scores["precision"] * en_len) / max(en_len.sum(), 1))
+        recall = float(np.sum(scores["recall"] * zh_len) / max(zh_len.sum(), 1))
+        f1 = float(np.sum(scores["f1"] * (zh_len + en_len)) / max((zh_len + en_len).sum(), 1))
+
+        return {
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "normalized_f1": (f1 + 1) / 2,
+            "segments": len(segments)
+        }
+
+    def interpret_score(self, score):
+        """
+        解释BERTScore分数
+        
+        参数:
+            score: F1分数
+            
+        返回:
+            str: 对分数的定性解释
+        """
+        normalized = (score + 1) / 2  # BERTScore范围从-1到1，归一化到0-1
+        
+        if normalized >= 0.85:
+            return "优秀 (Excellent)"
+        elif normalized >= 0.70:
+            return "良好 (Good)"
+        elif normalized >= 0.60:
+            return "一般 (Fair)"
+        elif normalized >= 0.45:
+            return "较差 (Poor)"
+        else:
+            return "很差 (Very Poor)"
@@ -11,6 +11,11 @@ Usage:
 """
 
 import argparse, re, random, itertools, os, json
+import contextlib
+import hashlib
+import uuid
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Tuple
 import logging
@@ -20,9 +25,13 @@ import yaml
 # ── 1. 3rd-party deps ────────────────────────────────────────────────────────
 import torch
 import random, numpy as np, torch
-from sentence_transformers import SentenceTransformer, util  # GPU if available
-from datasets import Dataset, DatasetDict
+import pyarrow as pa
+from sentence_transformers import SentenceTransformer  # GPU if available
+from datasets import Features, Value
 from transformers import AutoTokenizer
+from bertalign.encoder import load_sentence_model
+from bertalign.store import SentenceStore
+from pipeline_metrics import MetricsCollector
 
 # ── 2. simple helpers ────────────────────────────────────────────────────────
 EN_SENT_RE = re.compile(r'(?<=[\.\?\!])\s+')                 # rudimentary EN
@@ -39,117 +48,582 @@ def set_seed(seed: int = 42):
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(seed)
         
-def split_sentences(text: str, lang: str) -> List[str]:
+def split_sentences(text: str, lang: str, store: bool = False) -> List[str]:
+    """Split into sentences; with store=True return a SentenceStore (one buffer + offsets)."""
     if lang == "en":
-        return [s.strip() for s in EN_SENT_RE.split(text) if s.strip()]
+        sents = (s.strip() for s in EN_SENT_RE.split(text) if s.strip())
     elif lang == "zh":
-        return [s.strip() for s in ZH_SENT_RE.split(text) if s.strip()]
+        sents = (s.strip() for s in ZH_SENT_RE.split(text) if s.strip())
     else:
         raise ValueError(lang)
+    return SentenceStore.from_list(sents) if store else list(sents)
 
-def noisify_en(sentence: str, drop_rate=(0.03, 0.05)) -> str:
-    low, high = drop_rate
-    words = sentence.split()
-    keep = [w for w in words
-            if not (w.lower() in STOP_WORDS and random.random() < random.uniform(low, high))]
-    return " ".join(keep)
+TOKENIZER_NAME = "deepseek-ai/deepseek-llm-7b-base"  # any fast tokenizer OK
 
-def chunk_paragraphs(sents: List[str], max_tokens: int, tok) -> List[str]:
+# ── 2a. on-the-fly augmentation ──────────────────────────────────────────────
+_U64 = np.uint64
+
+def record_seed(en: str, zh: str) -> int:
+    """Stable per-record noise seed (63 bits, fits the int64 `seed` column)."""
+    digest = hashlib.blake2b(f"{en}\t{zh}".encode("utf-8"), digest_size=8, person=b"noisy_en").digest()
+    return int.from_bytes(digest, "little") & (2 ** 63 - 1)
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    z = x + _U64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> _U64(30))) * _U64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> _U64(27))) * _U64(0x94D049BB133111EB)
+    return z ^ (z >> _U64(31))
+
+def _unit_floats(x: np.ndarray) -> np.ndarray:
+    return (x >> _U64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+class NoisyEn:
+    """Batched dataset transform adding `noisy_en` from each record's `seed`.
+
+    Each whitespace-separated word that is in STOP_WORDS (case-insensitive)
+    is dropped with probability `rate`, where `rate` is itself drawn
+    uniformly from `drop_rate=(low, high)` per word; other words are kept.
+    Every random draw is a counter-based hash of (seed, epoch, word
+    position): the result is identical for any batch size or worker order,
+    and changes with the epoch.
+
+        ds = load_from_disk(out)["train"]
+        noisy = NoisyEn()
+        ds.set_transform(noisy)
+        for epoch in range(n):
+            noisy.set_epoch(epoch)
+            ...
+    """
+
+    def __init__(self, epoch: int = 0, drop_rate=(0.03, 0.05)):
+        self.epoch = epoch
+        self.drop_rate = drop_rate
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __call__(self, batch: dict) -> dict:
+        low, high = self.drop_rate
+        words = [en.split() for en in batch["en"]]
+        counts = np.array([len(w) for w in words], dtype=np.int64)
+        flat = list(itertools.chain.from_iterable(words))
+        if not flat:
+            batch["noisy_en"] = ["" for _ in words]
+            return batch
+
+        seeds = np.asarray(batch["seed"], dtype=np.int64).astype(_U64)
+        key = _splitmix64(np.repeat(seeds, counts) ^ _splitmix64(np.full(len(flat), self.epoch, dtype=_U64)))
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        pos = (np.arange(len(flat)) - starts).astype(_U64)
+        u_draw = _unit_floats(_splitmix64(key + _U64(2) * pos))
+        u_rate = _unit_floats(_splitmix64(key + _U64(2) * pos + _U64(1)))
+
+        stop = np.fromiter((w.lower() in STOP_WORDS for w in flat), dtype=bool, count=len(flat))
+        keep = ~(stop & (u_draw < low + (high - low) * u_rate))
+
+        out, k = [], 0
+        for w, n in zip(words, counts):
+            out.append(" ".join(itertools.compress(w, keep[k:k + n])))
+            k += n
+        batch["noisy_en"] = out
+        return batch
+
+def _batch_token_lens(texts: List[str], tok, batch_size: int = 1024, pool=None) -> np.ndarray:
+    """Token count of every text (no special tokens), one tokenizer call per batch.
+
+    With a record pool (see record_pool) the batches are tokenized in the workers.
+    """
+    if pool is not None:
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        return np.concatenate([np.zeros(0, dtype=np.int64), *pool.map(_worker_token_lens, batches)])
+    lens = np.zeros(len(texts), dtype=np.int64)
+    for i in range(0, len(texts), batch_size):
+        enc = tok(texts[i:i + batch_size], add_special_tokens=False, return_attention_mask=False)
+        lens[i:i + len(enc["input_ids"])] = [len(ids) for ids in enc["input_ids"]]
+    return lens
+
+class SentenceTokenCounts:
+    """Cached token counts for a sentence list, tokenized once in batches.
+
+    first[i] counts sents[i] on its own, cont[i] counts " " + sents[i] (its
+    cost after a join space), so " ".join(sents[i:j]) costs
+    special + first[i] + sum(cont[i+1:j]). For whitespace pre-tokenizers that
+    sum is exact; `additive` records whether a probe on real joins agreed,
+    and when it did not, counts near a boundary are re-checked exactly.
+    """
+
+    def __init__(self, sents: List[str], tok, batch_size: int = 1024, probe: int = 32, pool=None):
+        self.sents = sents
+        self.tok = tok
+        self.first = _batch_token_lens(sents, tok, batch_size, pool)
+        self.cont = _batch_token_lens([" " + s for s in sents], tok, batch_size, pool)
+        self.special = len(tok("").input_ids)
+        self.cum_cont = np.concatenate([[0], np.cumsum(self.cont)])
+        self.additive = self._probe(probe)
+
+    def estimate(self, i: int, j: int) -> int:
+        return int(self.special + self.first[i] + self.cum_cont[j] - self.cum_cont[i + 1])
+
+    def exact(self, i: int, j: int) -> int:
+        return len(self.tok(" ".join(self.sents[i:j])).input_ids)
+
+    def span_cont(self, i: int, j: int) -> int:
+        """Tokens of " " + " ".join(sents[i:j]), i.e. the span after a space."""
+        return int(self.cum_cont[j] - self.cum_cont[i])
+
+    def _probe(self, n: int) -> bool:
+        rng = random.Random(0)          # don't disturb the global seed
+        for _ in range(min(n, len(self.sents))):
+            i = rng.randrange(len(self.sents))
+            j = min(len(self.sents), i + rng.randint(2, 8))
+            if self.estimate(i, j) != self.exact(i, j):
+                return False
+        return True
+
+def pack_sentences(counts: SentenceTokenCounts, max_tokens: int) -> List[Tuple[int, int]]:
+    """Greedy pack sentences until ~max_tokens; returns (start, end) spans in one pass."""
+    spans, start = [], 0
+    n = len(counts.sents)
+    for end in range(1, n + 1):
+        n_tok = counts.estimate(start, end)
+        # a join can merge or split at most ~one token per boundary
+        if not counts.additive and n_tok >= max_tokens - (end - start):
+            n_tok = counts.exact(start, end)
+        if n_tok >= max_tokens:
+            spans.append((start, end))
+            start = end
+    if start < n:
+        spans.append((start, n))
+    return spans
+
+def chunk_paragraphs(sents: List[str], max_tokens: int, tok,
+                     counts: SentenceTokenCounts = None) -> List[str]:
     """Greedy pack sentences until ~max_tokens."""
-    chunks, buff = [], []
-    for s in sents:
-        buff.append(s)
-        if len(tok(" ".join(buff)).input_ids) >= max_tokens:
-            chunks.append(" ".join(buff))
-            buff = []
-    if buff:
-        chunks.append(" ".join(buff))
-    return chunks
+    counts = counts or SentenceTokenCounts(sents, tok)
+    return [" ".join(sents[i:j]) for i, j in pack_sentences(counts, max_tokens)]
+
+def tagged_text(en: str, zh: str) -> str:
+    return f"<en> {en} </en><zh> {zh} </zh>"
+
+def tagged_token_lens(en_counts: SentenceTokenCounts, en_spans: List[Tuple[int, int]],
+                      zh_counts: SentenceTokenCounts, zh_spans: List[Tuple[int, int]],
+                      tok, probe: int = 8, pool=None) -> np.ndarray:
+    """tok_len of tagged_text() for each (en span, zh span) pair from cached counts.
+
+    Falls back to one batched tokenization of the tagged texts when the
+    cached counts don't reproduce the real length on a probe sample.
+    """
+    tag_lens = _batch_token_lens(["<en>", " </en><zh>", " </zh>"], tok)
+    lens = np.array([en_counts.special + tag_lens.sum()
+                     + en_counts.span_cont(ei, ej) + zh_counts.span_cont(zi, zj)
+                     for (ei, ej), (zi, zj) in zip(en_spans, zh_spans)], dtype=np.int64)
+
+    def text(k):
+        (ei, ej), (zi, zj) = en_spans[k], zh_spans[k]
+        return tagged_text(" ".join(en_counts.sents[ei:ej]), " ".join(zh_counts.sents[zi:zj]))
+
+    if all(lens[k] == len(tok(text(k)).input_ids) for k in range(min(probe, len(lens)))):
+        return lens
+    texts = [text(k) for k in range(len(lens))]
+    return _batch_token_lens(texts, tok, pool=pool) + en_counts.special
+
+# ── 2b. batched tokenization across a process pool ──────────────────────────
+_WORKER_TOK = None
+
+def _init_worker(tok_name: str):
+    global _WORKER_TOK
+    _WORKER_TOK = AutoTokenizer.from_pretrained(tok_name)
+
+def _worker_token_lens(texts: List[str]) -> np.ndarray:
+    return _batch_token_lens(texts, _WORKER_TOK, batch_size=len(texts) or 1)
+
+def _record_batch(en_texts: List[str], zh_texts: List[str]) -> dict:
+    return {"en": en_texts,
+            "zh": zh_texts,
+            "text": [tagged_text(e, z) for e, z in zip(en_texts, zh_texts)],
+            "seed": [record_seed(e, z) for e, z in zip(en_texts, zh_texts)]}
+
+def record_pool(workers: int, tok_name: str = TOKENIZER_NAME):
+    """
+    Process pool for the batched tokenizer calls; each worker holds its own
+    tokenizer. A no-op context for workers <= 1.
+    """
+    if workers <= 1:
+        return contextlib.nullcontext()
+    # spawn: the parent may already hold CUDA / tokenizer threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                               initializer=_init_worker, initargs=(tok_name,))
+
+def iter_record_batches(en_texts: List[str], zh_texts: List[str], tok_lens: np.ndarray,
+                        batch_size: int = 2048):
+    """Yield records column-wise in batches; tok_len is an int64 array per batch.
+
+    Columns are plain string work and are built in this process: shipping
+    the texts to the pool and back would cost more than building them.
+    """
+    tok_lens = np.asarray(tok_lens, dtype=np.int64)
+    for i in range(0, len(en_texts), batch_size):
+        batch = _record_batch(en_texts[i:i + batch_size], zh_texts[i:i + batch_size])
+        batch["tok_len"] = tok_lens[i:i + batch_size]
+        yield batch
+
+# ── 2c. streaming Arrow output ───────────────────────────────────────────────
+FEATURES = Features({
+    "en": Value("string"),
+    "zh": Value("string"),
+    "text": Value("string"),
+    "tok_len": Value("int64"),
+    "seed": Value("int64"),
+})
+
+def is_valid_record(en: str, zh: str, seed: int, valid_frac: float) -> bool:
+    """Seeded hash split: a pair lands in the same split on every run."""
+    digest = hashlib.blake2b(f"{en}\t{zh}".encode("utf-8"), digest_size=8,
+                             key=seed.to_bytes(8, "little")).digest()
+    return int.from_bytes(digest, "little") / 2 ** 64 < valid_frac
+
+class ArrowShardWriter:
+    """Write column batches for one split straight into Arrow shards.
+
+    The directory layout (data-XXXXX-of-NNNNN.arrow, state.json,
+    dataset_info.json) is the one Dataset.save_to_disk produces, so the
+    result opens with datasets.load_from_disk.
+
+    With bucket_bounds, records are routed by tok_len into per-bucket shards
+    (bucket b holds bounds[b-1] < tok_len <= bounds[b], the last bucket the
+    rest) and shards are ordered by bucket. close() also writes lengths.npz,
+    the tok_len / bucket of every row in final row order.
+    """
+
+    def __init__(self, split_dir: Path, features: Features = FEATURES, shard_rows: int = 100_000,
+                 bucket_bounds=()):
+        self.split_dir = Path(split_dir)
+        self.features = features
+        self.shard_rows = shard_rows
+        self.bucket_bounds = np.asarray(sorted(bucket_bounds), dtype=np.int64)
+        self.schema = features.arrow_schema.with_metadata(
+            {"huggingface": json.dumps({"info": {"features": features.to_dict()}})})
+        self.num_rows = 0
+        self._shards = []           # [bucket, tmp path, [tok_len arrays]] in creation order
+        self._open = {}             # bucket -> (stream writer, shard entry, rows written)
+        self.split_dir.mkdir(parents=True, exist_ok=True)
+        # stale output of a previous (possibly crashed) run: shards, their .tmp files,
+        # and the length index / packing plan that describe the old rows
+        for pattern in ("data-*.arrow", "data-*.arrow.tmp", "lengths.npz", "packing_plan.npz"):
+            for old in self.split_dir.glob(pattern):
+                old.unlink()
+
+    def _new_shard(self, bucket: int):
+        path = self.split_dir / f"data-{len(self._shards):05d}.arrow.tmp"
+        shard = [bucket, path, []]
+        self._shards.append(shard)
+        self._open[bucket] = (pa.ipc.new_stream(str(path), self.schema), shard, 0)
+
+    def write_batch(self, columns: dict):
+        batch = pa.RecordBatch.from_pydict({k: columns[k] for k in self.schema.names}, schema=self.schema)
+        if batch.num_rows == 0:
+            return
+        tok_len = np.asarray(columns["tok_len"], dtype=np.int64)
+        buckets = np.searchsorted(self.bucket_bounds, tok_len, side="left")
+        for bucket in np.unique(buckets):
+            idx = np.flatnonzero(buckets == bucket)
+            part = batch if len(idx) == batch.num_rows else batch.take(pa.array(idx))
+            bucket = int(bucket)
+            if bucket not in self._open or self._open[bucket][2] >= self.shard_rows:
+                if bucket in self._open:
+                    self._open[bucket][0].close()
+                self._new_shard(bucket)
+            writer, shard, rows = self._open[bucket]
+            writer.write_batch(part)
+            shard[2].append(tok_len[idx].astype(np.int32))
+            self._open[bucket] = (writer, shard, rows + part.num_rows)
+            self.num_rows += part.num_rows
+
+    def close(self) -> int:
+        for writer, _, _ in self._open.values():
+            writer.close()
+        self._open = {}
+        if not self._shards:                # keep empty splits loadable
+            self._new_shard(0)
+            self._open.pop(0)[0].close()
+        shards = sorted(self._shards, key=lambda sh: sh[0])    # stable: creation order within a bucket
+        n = len(shards)
+        files, lens, buckets = [], [], []
+        for k, (bucket, tmp, tok_lens) in enumerate(shards):
+            name = f"data-{k:05d}-of-{n:05d}.arrow"
+            tmp.rename(self.split_dir / name)
+            files.append({"filename": name})
+            lens.extend(tok_lens)
+            buckets.append(np.full(sum(len(t) for t in tok_lens), bucket, dtype=np.int16))
+        state = {"_data_files": files,
+                 "_fingerprint": uuid.uuid4().hex[:16],
+                 "_format_columns": None,
+                 "_format_kwargs": {},
+                 "_format_type": None,
+                 "_output_all_columns": False,
+                 "_split": None}
+        info = {"citation": "", "description": "", "features": self.features.to_dict(),
+                "homepage": "", "license": ""}
+        (self.split_dir / "state.json").write_text(json.dumps(state, indent=2), encoding="utf-8")
+        (self.split_dir / "dataset_info.json").write_text(json.dumps(info, indent=2), encoding="utf-8")
+        np.savez(self.split_dir / "lengths.npz",
+                 tok_len=np.concatenate([np.zeros(0, dtype=np.int32), *lens]),
+                 bucket=np.concatenate(buckets),
+                 bucket_bounds=self.bucket_bounds)
+        return n
+
+# ── 2d. sequence packing plan ────────────────────────────────────────────────
+def plan_packing(lengths: np.ndarray, context: int, sep_tokens: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Best-fit-decreasing packing of rows into sequences of at most `context` tokens.
+
+    Each row costs tok_len + sep_tokens; rows longer than the context get a
+    pack of their own. Returns CSR arrays (order, offsets): pack p holds the
+    rows order[offsets[p]:offsets[p + 1]].
+    """
+    cost = np.minimum(np.asarray(lengths, dtype=np.int64) + sep_tokens, context)
+    free = [[] for _ in range(context + 1)]    # remaining capacity -> open pack ids
+    has_free = np.zeros(context + 1, dtype=bool)
+    packs = []
+    for row in np.argsort(-cost, kind="stable"):
+        need = int(cost[row])
+        cap = need + int(has_free[need:].argmax())  # tightest open pack that fits
+        if not has_free[cap]:
+            pack_id, cap = len(packs), context
+            packs.append([])
+        else:
+            pack_id = free[cap].pop()
+            has_free[cap] = bool(free[cap])
+        packs[pack_id].append(int(row))
+        if cap - need > 0:
+            free[cap - need].append(pack_id)
+            has_free[cap - need] = True
+    order = np.fromiter(itertools.chain.from_iterable(packs), dtype=np.int64, count=len(cost))
+    offsets = np.cumsum([0] + [len(p) for p in packs], dtype=np.int64)
+    return order, offsets
+
+def write_packing_plan(split_dir: Path, context: int, sep_tokens: int = 0) -> float:
+    """Compute the packing plan of a split from lengths.npz; returns the fill ratio."""
+    split_dir = Path(split_dir)
+    lengths = np.load(split_dir / "lengths.npz")["tok_len"]
+    order, offsets = plan_packing(lengths, context, sep_tokens)
+    n_packs = len(offsets) - 1
+    fill = float(np.minimum(lengths + sep_tokens, context).sum()) / max(1, n_packs * context)
+    np.savez(split_dir / "packing_plan.npz", order=order, offsets=offsets,
+             context=context, sep_tokens=sep_tokens)
+    return fill
+
+def iter_packs(split, split_dir: Path):
+    """Yield each planned pack of a loaded split as a column batch (no re-tokenization)."""
+    plan = np.load(Path(split_dir) / "packing_plan.npz")
+    order, offsets = plan["order"], plan["offsets"]
+    for p in range(len(offsets) - 1):
+        yield split[order[offsets[p]:offsets[p + 1]].tolist()]
+
+class SplitWriter:
+    """Route record batches to train/valid ArrowShardWriters by seeded hash."""
+
+    def __init__(self, out: Path, seed: int, valid_frac: float = 0.1, shard_rows: int = 100_000,
+                 bucket_bounds=()):
+        self.out = Path(out)
+        self.seed = seed
+        self.valid_frac = valid_frac
+        self.splits = {name: ArrowShardWriter(self.out / name, shard_rows=shard_rows,
+                                              bucket_bounds=bucket_bounds)
+                       for name in ("train", "valid")}
+
+    def write_batch(self, columns: dict):
+        valid = np.array([is_valid_record(e, z, self.seed, self.valid_frac)
+                          for e, z in zip(columns["en"], columns["zh"])], dtype=bool)
+        for name, mask in (("train", ~valid), ("valid", valid)):
+            idx = np.flatnonzero(mask)
+            self.splits[name].write_batch(
+                {k: (v[idx] if isinstance(v, np.ndarray) else [v[i] for i in idx])
+                 for k, v in columns.items()})
+
+    def close(self) -> dict:
+        shards = {name: w.close() for name, w in self.splits.items()}
+        (self.out / "dataset_dict.json").write_text(json.dumps({"splits": list(self.splits)}), encoding="utf-8")
+        return shards
 
 # ── 3. alignment with SBERT / BERT-aligner ───────────────────────────────────
+def blockwise_top1(en_emb: torch.Tensor, zh_emb: torch.Tensor,
+                   row_tile: int = 4096, col_tile: int = 16384) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Best ZH match for every EN row without materialising the full sim matrix.
+
+    Embeddings must be L2-normalised (dot product == cosine). Peak extra memory
+    is one row_tile x col_tile block; only a running top-1 per row is kept.
+    Returns (best_j, best_score), both of length N_en.
+    """
+    n_en, n_zh = en_emb.size(0), zh_emb.size(0)
+    best_score = torch.full((n_en,), -float("inf"), device=en_emb.device)
+    best_j = torch.zeros(n_en, dtype=torch.long, device=en_emb.device)
+    for r0 in range(0, n_en, row_tile):
+        rows = en_emb[r0:r0 + row_tile]
+        for c0 in range(0, n_zh, col_tile):
+            score, j = (rows @ zh_emb[c0:c0 + col_tile].T).max(dim=1)
+            better = score > best_score[r0:r0 + row_tile]   # strict: ties keep the lowest j
+            best_score[r0:r0 + row_tile] = torch.where(better, score, best_score[r0:r0 + row_tile])
+            best_j[r0:r0 + row_tile] = torch.where(better, j + c0, best_j[r0:r0 + row_tile])
+    return best_j, best_score
+
+def align_indices(en_sents: List[str], zh_sents: List[str],
+                  model: SentenceTransformer, device: str,
+                  row_tile: int = 4096, col_tile: int = 16384) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Greedy 1-1 alignment as index arrays (en_idx, zh_idx, cosine).
+
+    Each EN sentence takes its most similar ZH sentence; a ZH sentence claimed
+    by an earlier EN sentence is not reused.
+    """
+    model = model.to(device)
+    en_emb = model.encode(en_sents, convert_to_tensor=True, device=device,
+                          normalize_embeddings=True, show_progress_bar=False)
+    zh_emb = model.encode(zh_sents, convert_to_tensor=True, device=device,
+                          normalize_embeddings=True, show_progress_bar=False)
+
+    best_j, best_score = blockwise_top1(en_emb, zh_emb, row_tile, col_tile)
+    best_j = best_j.cpu().numpy()
+    best_score = best_score.float().cpu().numpy()
+
+    # first EN row claiming each ZH index wins, kept in EN order
+    _, first_rows = np.unique(best_j, return_index=True)
+    en_idx = np.sort(first_rows)
+    return en_idx, best_j[en_idx], best_score[en_idx]
+
 def align(en_sents: List[str], zh_sents: List[str],
-          model: SentenceTransformer, device: str) -> List[Tuple[str, str]]:
+          model: SentenceTransformer, device: str,
+          row_tile: int = 4096, col_tile: int = 16384) -> List[Tuple[str, str]]:
     """Greedy 1-1 sentence alignment using cosine similarity."""
-    model = model.to(device)
-    en_emb = model.encode(en_sents, convert_to_tensor=True, device=device, show_progress_bar=False)
-    zh_emb = model.encode(zh_sents, convert_to_tensor=True, device=device, show_progress_bar=False)
-
-    sim = util.cos_sim(en_emb, zh_emb)          # shape (N_en, N_zh)
-    pairs = []
-    used_zh = set()
-    for i in range(sim.size(0)):
-        j = torch.argmax(sim[i]).item()
-        if j not in used_zh:                    # keep unique match
-            pairs.append((en_sents[i], zh_sents[j]))
-            used_zh.add(j)
-    return pairs
+    en_idx, zh_idx, _ = align_indices(en_sents, zh_sents, model, device, row_tile, col_tile)
+    return [(en_sents[i], zh_sents[j]) for i, j in zip(en_idx, zh_idx)]
 
 # ── 4. main pipeline ────────────────────────────────────────────────────────
-def main(config):
-    device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
-    print(f"🔹 Using device: {device}")
+def build_book(en_path: str, zh_path: str, config, sbert: SentenceTransformer, tok, pool,
+               device: str, cascade=None, metrics=None):
+    """Yield the record batches of one book (sentence level, then paragraph level)."""
+    metrics = metrics or MetricsCollector("en_zh_dataset")
+    book = Path(en_path).stem
 
     # 4.1 read raw books
-    en_raw = Path(config["en"]).read_text(encoding="utf-8")
-    zh_raw = Path(config["zh"]).read_text(encoding="utf-8")
+    with metrics.stage("split", unit="sentences", book=book) as m:
+        en_raw = Path(en_path).read_text(encoding="utf-8")
+        zh_raw = Path(zh_path).read_text(encoding="utf-8")
 
-    en_sents = split_sentences(en_raw, "en")
-    zh_sents = split_sentences(zh_raw, "zh")
-    print(f"🔹 Split into {len(en_sents)} EN & {len(zh_sents)} ZH sentences")
+        store = bool(config.get("sentence_store", False))
+        en_sents = split_sentences(en_raw, "en", store)
+        zh_sents = split_sentences(zh_raw, "zh", store)
+        m.items += len(en_sents) + len(zh_sents)
+        m.bytes_read += Path(en_path).stat().st_size + Path(zh_path).stat().st_size
+    print(f"🔹 {Path(en_path).name}: split into {len(en_sents)} EN & {len(zh_sents)} ZH sentences")
 
     # 4.2 embed & align
-    sbert = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-    sent_pairs = align(en_sents, zh_sents, sbert, device)
-    print(f"🔹 Aligned {len(sent_pairs)} sentence pairs")
+    with metrics.stage("align", unit="pairs", book=book) as m:
+        en_idx, zh_idx, cos = align_indices(en_sents, zh_sents, sbert, device,
+                                            row_tile=config.get("sim_row_tile", 4096),
+                                            col_tile=config.get("sim_col_tile", 16384))
+        m.items += len(en_idx)
+    print(f"🔹 Aligned {len(en_idx)} sentence pairs")
+
+    # 4.2b quality cascade: cosine decides the clear cases, BERTScore the rest
+    if cascade is not None:
+        with metrics.stage("quality_filter", unit="pairs", book=book) as m:
+            keep = cascade.filter([zh_sents[j] for j in zh_idx], [en_sents[i] for i in en_idx], cos)
+            m.items += len(keep)
+        en_idx, zh_idx = en_idx[keep], zh_idx[keep]
+        print(f"🔹 Quality filter kept {len(en_idx)} pairs "
+              f"(cosine accept ≥ {cascade.accept_above:.3f}, reject < {cascade.reject_below:.3f})")
 
-    # 4.3 tokenizer for token length & chunking
-    tok = AutoTokenizer.from_pretrained("deepseek-ai/deepseek-llm-7b-base")  # any fast tokenizer OK
+    # 4.3 token counts for length & chunking; every sentence is tokenized once
+    with metrics.stage("tokenize", unit="sentences", book=book) as m:
+        en_counts = SentenceTokenCounts(en_sents, tok, pool=pool)
+        zh_counts = SentenceTokenCounts(zh_sents, tok, pool=pool)
+        m.items += len(en_sents) + len(zh_sents)
 
     # 4.4 build records ─ sentence level
-    records = []
-    for en_sent, zh_sent in sent_pairs:
-        tags   = f"<en> {en_sent} </en><zh> {zh_sent} </zh>"
-        toklen = len(tok(tags).input_ids)
-        records.append(
-            {"en": en_sent,
-             "zh": zh_sent,
-             "text": tags,
-             "tok_len": toklen,
-             "noisy_en": noisify_en(en_sent)}
-        )
+    en_spans = [(i, i + 1) for i in en_idx]
+    zh_spans = [(j, j + 1) for j in zh_idx]
+    tok_lens = tagged_token_lens(en_counts, en_spans, zh_counts, zh_spans, tok, pool=pool)
+    yield from iter_record_batches([en_sents[i] for i in en_idx], [zh_sents[j] for j in zh_idx], tok_lens)
 
     # 4.5 add doc-/paragraph-level chunks for long-context curriculum
-    para_en  = chunk_paragraphs(en_sents, config["max_chunk"], tok)
-    para_zh  = chunk_paragraphs(zh_sents, config["max_chunk"], tok)
-    long_pairs = list(zip(para_en, para_zh))
-    print(f"🔹 Added {len(long_pairs)} paragraph-level pairs (~≤{config['max_chunk']} tokens)")
-
-    for en_para, zh_para in long_pairs:
-        tags   = f"<en> {en_para} </en><zh> {zh_para} </zh>"
-        toklen = len(tok(tags).input_ids)
-        records.append(
-            {"en": en_para,
-             "zh": zh_para,
-             "text": tags,
-             "tok_len": toklen,
-             "noisy_en": noisify_en(en_para)}
-        )
-
-    # 4.6 build Dataset & train/valid split
-    random.shuffle(records)
-    split = int(0.9 * len(records))
-    ds = Dataset.from_list(records)
-    dsdict = DatasetDict({
-        "train": ds.select(range(split)),
-        "valid": ds.select(range(split, len(ds)))
-    })
-
-    # 4.7 save
+    en_spans = pack_sentences(en_counts, config["max_chunk"])
+    zh_spans = pack_sentences(zh_counts, config["max_chunk"])
+    en_spans, zh_spans = en_spans[:len(zh_spans)], zh_spans[:len(en_spans)]
+    tok_lens = tagged_token_lens(en_counts, en_spans, zh_counts, zh_spans, tok, pool=pool)
+    print(f"🔹 Added {len(en_spans)} paragraph-level pairs (~≤{config['max_chunk']} tokens)")
+    yield from iter_record_batches([" ".join(en_sents[i:j]) for i, j in en_spans],
+                                   [" ".join(zh_sents[i:j]) for i, j in zh_spans],
+                                   tok_lens)
+
+def main(config):
+    device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+    print(f"🔹 Using device: {device}")
+
+    books = config.get("books") or [{"en": config["en"], "zh": config["zh"]}]
+    backend = config.get("encoder_backend", "torch")
+    sbert = load_sentence_model("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", backend)
+    if backend != "torch":
+        device = "cpu"                  # quantized / onnx models run on CPU only
+        print(f"🔹 Encoder backend: {backend} (cpu)")
+    tok = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    # each worker loads its own tokenizer, so the default pool stays small
+    workers = int(config.get("record_workers") or min(4, os.cpu_count() or 1))
+    split_seed = int(config.get("split_seed", 12345))
+    metrics = MetricsCollector("en_zh_dataset", labels={"config": "dataset_parameter.yml"})
+
+    cascade = None
+    if config.get("quality_min_f1") is not None:
+        from translation_evaluator import TranslationEvaluator
+        from cascade_filter import CascadeFilter
+        cascade = CascadeFilter(TranslationEvaluator(tier=config.get("quality_tier", "accurate")),
+                                min_f1=float(config["quality_min_f1"]),
+                                sample_size=int(config.get("quality_sample", 1000)),
+                                max_error=float(config.get("quality_max_error", 0.02)),
+                                seed=split_seed)
+
+    # 4.6 stream records into train/valid Arrow shards as they are produced
     out = Path(config["out"])
-    out.mkdir(parents=True, exist_ok=True)
-    dsdict.save_to_disk(str(out))
+    writer = SplitWriter(out, seed=split_seed,
+                         valid_frac=config.get("valid_frac", 0.1),
+                         shard_rows=config.get("shard_rows", 100_000),
+                         bucket_bounds=config.get("length_buckets") or ())
+    with record_pool(workers) as pool:
+        for book in books:
+            name = Path(book["en"]).stem
+            for batch in build_book(book["en"], book["zh"], config, sbert, tok, pool, device, cascade, metrics):
+                with metrics.stage("write", unit="records", book=name) as m:
+                    writer.write_batch(batch)
+                    m.items += len(batch["en"])
+
+    if cascade is not None:
+        s = cascade.stats
+        print(f"🔹 Quality filter: {s['accepted']} accepted / {s['rejected']} rejected by cosine, "
+              f"{s['evaluated']} scored by BERTScore, {s['kept']} kept")
+
+    # 4.7 finalize shards
+    with metrics.stage("finalize", unit="shards") as m:
+        shards = writer.close()
+        m.items += sum(shards.values())
+        m.bytes_written += sum(f.stat().st_size for f in out.rglob("*") if f.is_file())
+    rows = {name: w.num_rows for name, w in writer.splits.items()}
+    print(f"🔹 Wrote {rows['train']} train / {rows['valid']} valid records "
+          f"in {shards['train']} + {shards['valid']} shards")
+
+    # 4.8 length index is in <split>/lengths.npz; precompute the packing plan
+    context = config.get("pack_context")
+    if context:
+        for name in writer.splits:
+            with metrics.stage("pack_plan", unit="records", split=name) as m:
+                fill = write_packing_plan(out / name, int(context), int(config.get("pack_sep_tokens", 0)))
+                m.items += rows[name]
+            print(f"🔹 {name}: packing plan for {context}-token context, {fill:.1%} fill")
     print(f"✅ Saved Hugging Face dataset to: {out.resolve()}")
 
+    # 4.9 run metrics (per-stage timings, throughput, peak RSS)
+    metrics_prefix = config.get("metrics_prefix") or out / "metrics"
+    report = metrics.write(metrics_prefix)
+    print(f"✅ Metrics: {metrics_prefix}.json / .prom "
+          f"({report['wall_seconds']:.1f}s, peak RSS {(report['peak_rss_bytes'] or 0) / 2**20:.0f} MiB)")
+
 if __name__ == "__main__":
     with open("dataset_parameter.yml", "r", encoding="utf-8") as f:
         config = yaml.safe_load(f)
@@ -0,0 +1,88 @@
+"""
+cascade_filter.py
+
+Two-stage quality filter for aligned sentence pairs.
+
+Every pair already has a sentence-embedding cosine from the aligner. The
+cosine is cheap but noisy, so it is only trusted at the extremes: pairs
+above `accept_above` are kept and pairs below `reject_below` are dropped
+without further work, and only the uncertain band in between is scored by
+`TranslationEvaluator` (BERTScore F1 >= min_f1 keeps a pair).
+
+The two thresholds are calibrated on a random sample scored by the
+evaluator: `accept_above` is the lowest cosine above which at most
+`max_error` of the sample falls below min_f1, `reject_below` the highest
+cosine under which at most `max_error` of the sample reaches it. The
+calibration runs on the first call and is reused for later books.
+"""
+
+import numpy as np
+
+
+class CascadeFilter:
+    def __init__(self, evaluator, min_f1: float, sample_size: int = 1000,
+                 max_error: float = 0.02, min_support: int = 50, batch_size: int = 64, seed: int = 0):
+        self.evaluator = evaluator
+        self.min_f1 = min_f1
+        self.sample_size = sample_size
+        self.max_error = max_error
+        self.min_support = min_support
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.reject_below = None
+        self.accept_above = None
+        self.stats = {"accepted": 0, "rejected": 0, "evaluated": 0, "kept": 0}
+
+    @property
+    def calibrated(self) -> bool:
+        return self.accept_above is not None
+
+    def _f1(self, zh_texts, en_texts, idx) -> np.ndarray:
+        if len(idx) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return self.evaluator.evaluate_batch([zh_texts[i] for i in idx], [en_texts[i] for i in idx],
+                                             batch_size=self.batch_size)["f1"]
+
+    def calibrate(self, cos: np.ndarray, f1: np.ndarray):
+        """Pick accept/reject cosine thresholds from an evaluator-scored sample."""
+        order = np.argsort(cos, kind="stable")
+        c = cos[order]
+        good = f1[order] >= self.min_f1
+        n = len(c)
+
+        # accept: suffix (cos >= c[k]) that is at least 1 - max_error good
+        suffix_n = n - np.arange(n)
+        suffix_good = np.cumsum(good[::-1])[::-1]
+        ok = (suffix_good >= (1 - self.max_error) * suffix_n) & (suffix_n >= self.min_support)
+        self.accept_above = float(c[np.argmax(ok)]) if ok.any() else np.inf
+
+        # reject: prefix (cos <= c[k]) that is at least 1 - max_error bad
+        prefix_n = np.arange(1, n + 1)
+        prefix_bad = np.cumsum(~good)
+        ok = (prefix_bad >= (1 - self.max_error) * prefix_n) & (prefix_n >= self.min_support)
+        self.reject_below = float(np.nextafter(c[np.flatnonzero(ok)[-1]], np.inf)) if ok.any() else -np.inf
+        self.reject_below = min(self.reject_below, self.accept_above)
+
+    def filter(self, zh_texts, en_texts, cos) -> np.ndarray:
+        """Return the keep mask for pairs (zh_texts[i], en_texts[i]) with cosine cos[i]."""
+        cos = np.asarray(cos, dtype=np.float32)
+        f1 = np.full(len(cos), np.nan, dtype=np.float32)
+
+        if not self.calibrated and len(cos):
+            sample = self.rng.choice(len(cos), min(len(cos), self.sample_size), replace=False)
+            f1[sample] = self._f1(zh_texts, en_texts, sample)
+            self.calibrate(cos[sample], f1[sample])
+            self.stats["evaluated"] += len(sample)
+
+        pending = np.isnan(f1)
+        accept = pending & (cos >= self.accept_above)
+        reject = pending & (cos < self.reject_below)
+        band = np.flatnonzero(pending & ~accept & ~reject)
+        f1[band] = self._f1(zh_texts, en_texts, band)
+
+        keep = accept | (~np.isnan(f1) & (f1 >= self.min_f1))
+        self.stats["accepted"] += int(accept.sum())
+        self.stats["rejected"] += int(reject.sum())
+        self.stats["evaluated"] += len(band)
+        self.stats["kept"] += int(keep.sum())
+        return keep
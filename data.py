@@ -1,12 +1,20 @@
 import yaml
-import json
 import re
 import os
+import json
 import time
+import multiprocessing as mp
 from pathlib import Path
 from collections import Counter
-from sentence_transformers import SentenceTransformer
-from bertalign.aligner import Bertalign as Aligner
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bertalign
+from bertalign.chapter import chapter_vectors, match_chapters
+from bertalign.store import SentenceStore
+from jsonl_writer import JsonlWriter
+from pipeline import Pipeline, Stage
+from pipeline_metrics import MetricsCollector
+from sentence_split import NLTK_DATA_DIR, OpenCC, convert_t2s, en_sents, split_chunk, zh_sents
 import ebooklib
 from ebooklib import epub
 from bs4 import BeautifulSoup
@@ -14,15 +22,6 @@ from tqdm.auto import tqdm
 import nltk
 import logging
 
-try:
-    from opencc import OpenCC
-except ImportError:
-    OpenCC = None
-
-# Configure NLTK to use local data directory
-NLTK_DATA_DIR = Path("./nltk_data").absolute()
-nltk.data.path.insert(0, str(NLTK_DATA_DIR))
-
 # Configure logging with timestamp
 logging.basicConfig(
     level=logging.INFO,
@@ -41,6 +40,22 @@ STAGE_COMPLETE = "PROCESS COMPLETE"
 # Use the correct constant for ebooklib document items
 datatype = ebooklib.ITEM_DOCUMENT
 
+# Chunking modes for build_dataset
+CHUNK_MODE_CHARS = "chars"      # pack until the Chinese character count reaches chunk_size
+CHUNK_MODE_TOKENS = "tokens"    # pack until either side of the record (input with its prompt) would exceed chunk_tokens tokens
+DEFAULT_TOKENIZER = "deepseek-ai/deepseek-llm-7b-base"
+# Alpaca prompt the trainer wraps around each record; its tokens count against chunk_tokens on the input side
+ALPACA_PROMPT = ("Below is an instruction that describes a task, paired with an input that provides further context. "
+                 "Write a response that appropriately completes the request.\n\n"
+                 "### Instruction:\n{instruction}\n\n### Input:\n{input}\n\n### Response:\n")
+ALIGN_MAX_ALIGN = 5             # Bertalign default; embeddings are computed with max_align - 1 overlaps
+# spawn: the parent already holds torch / numba / tokenizer threads (and a live zh thread in build_dataset).
+# Spawned workers re-import this module, so torch, transformers and the aligner are imported inside
+# the functions that use them; the splitting workers themselves live in sentence_split.
+_SPAWN = mp.get_context("spawn")
+ALIGN_MIN_CHAPTER_SENTS = 3     # Matched chapter pairs with fewer sentences on a side are not aligned (Bertalign top_k)
+_CHAPTER_MARK = "\ue000"        # Private-use character marking EPUB document boundaries through postprocess
+
 # ---------------- YAML CONFIG ----------------
 def load_config(yaml_path="parameter.yml"):
     logging.info(f"[{STAGE_INIT}] Loading configuration from {yaml_path}")
@@ -76,7 +91,7 @@ def epub_to_txt(epub_path: str, txt_path: str, postprocess_func):
     
     try:
         book = epub.read_epub(epub_path)
-        chunks = []
+        chunks, names = [], []
         items_count = 0
         for item in book.get_items_of_type(datatype):
             items_count += 1
@@ -84,20 +99,72 @@ def epub_to_txt(epub_path: str, txt_path: str, postprocess_func):
                 # Use html.parser as it's more reliable than lxml and always available
                 soup = BeautifulSoup(item.get_content(), "html.parser")
                 chunks.append(soup.get_text(separator="\n"))
+                names.append(item.get_name())
             except Exception as e:
                 logging.warning(f"[{STAGE_EPUB_TO_TXT}] Error processing item {items_count}: {str(e)}")
         
         logging.info(f"[{STAGE_EPUB_TO_TXT}] Processed {items_count} document items from EPUB")
-        raw_text = "\n\n".join(chunks)
-        cleaned = postprocess_func(raw_text)
+        # Documents are separated by a marker paragraph so chapter boundaries survive cleaning
+        raw_text = f"\n\n{_CHAPTER_MARK}\n\n".join(chunks)
+        cleaned, chapters = _split_chapter_marks(postprocess_func(raw_text), names, _toc_titles(book))
         
         Path(txt_path).write_text(cleaned, encoding="utf-8")
-        logging.info(f"[{STAGE_EPUB_TO_TXT}] Saved cleaned text ({len(cleaned)} chars) => {txt_path}")
+        chapters_path(txt_path).write_text(json.dumps(chapters, ensure_ascii=False, indent=1), encoding="utf-8")
+        logging.info(f"[{STAGE_EPUB_TO_TXT}] Saved cleaned text ({len(cleaned)} chars, {len(chapters)} chapters) => {txt_path}")
         logging.info(f"[{STAGE_EPUB_TO_TXT}] Conversion completed in {time.time() - start_time:.2f} seconds")
     except Exception as e:
         logging.error(f"[{STAGE_EPUB_TO_TXT}] Failed to process {epub_path}: {str(e)}")
         raise
 
+def chapters_path(txt_path):
+    """Sidecar of a converted text file listing its chapters."""
+    return Path(txt_path).with_suffix(".chapters.json")
+
+def load_chapters(txt_path):
+    """Return the [{title, toc, href, start, end}] chapters of a converted text, or None without a sidecar."""
+    path = chapters_path(txt_path)
+    if not path.exists() or path.stat().st_mtime < Path(txt_path).stat().st_mtime:
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+def _toc_titles(book):
+    """Map document href -> title from the EPUB table of contents."""
+    titles = {}
+    def walk(entries):
+        for entry in entries:
+            if isinstance(entry, tuple):
+                section, children = entry
+                if getattr(section, "href", None):
+                    titles.setdefault(section.href.split("#")[0], section.title)
+                walk(children)
+            elif getattr(entry, "href", None):
+                titles.setdefault(entry.href.split("#")[0], entry.title)
+    walk(book.toc)
+    return titles
+
+def _split_chapter_marks(text, names, titles):
+    """Remove the document markers from cleaned text; return the text and its chapter spans."""
+    groups = [[]]
+    for line in text.split("\n"):
+        if line.strip() == _CHAPTER_MARK:
+            groups.append([])
+        else:
+            groups[-1].append(line)
+    
+    parts, chapters, pos = [], [], 0
+    for name, lines in zip(names, groups):
+        body = "\n".join(lines).strip("\n")
+        if not body.strip():
+            continue
+        if parts:
+            pos += 1    # joining newline
+        first_line = body.lstrip().split("\n", 1)[0][:80]
+        chapters.append({"title": titles.get(name) or first_line, "toc": bool(titles.get(name)), "href": name,
+                         "start": pos, "end": pos + len(body)})
+        parts.append(body)
+        pos += len(body)
+    return "\n".join(parts), chapters
+
 # ---------------- 文本清洗 ------------------
 _SENT_END = r"[.!?。！？]"
 _HEADER_THRESHOLD = 0.6
@@ -174,35 +241,110 @@ def postprocess(raw: str) -> str:
 # ---------------- 分句函数 -----------------
 def split_en(text, min_len=2):
     logging.info(f"[{STAGE_TOKENIZE}] Tokenizing English text ({len(text)} chars)")
-    sents = nltk.sent_tokenize(text)
-    filtered = [s.strip() for s in sents if len(s.strip()) >= min_len]
-    logging.info(f"[{STAGE_TOKENIZE}] Found {len(sents)} English sentences, {len(filtered)} after filtering")
+    filtered, total = en_sents(text, min_len)
+    logging.info(f"[{STAGE_TOKENIZE}] Found {total} English sentences, {len(filtered)} after filtering")
     return filtered
 
 def split_zh(text, min_len=2):
     logging.info(f"[{STAGE_TOKENIZE}] Tokenizing Chinese text ({len(text)} chars)")
-    sents = [s for s in re.split(r'(?<=[。！？])\s*', text) if s.strip()]
-    filtered = [s.strip() for s in sents if len(s.strip()) >= min_len]
-    logging.info(f"[{STAGE_TOKENIZE}] Found {len(sents)} Chinese sentences, {len(filtered)} after filtering")
+    filtered, total = zh_sents(text, min_len)
+    logging.info(f"[{STAGE_TOKENIZE}] Found {total} Chinese sentences, {len(filtered)} after filtering")
+    return filtered
+
+# ---------------- 并行预处理 ---------------
+_CUT_RE = re.compile(_SENT_END + r"\n")
+
+def paragraph_chunks(text, chunk_chars):
+    """
+    Cut text into pieces of roughly chunk_chars. Cuts fall only on newlines
+    after a line ending in sentence punctuation, so no sentence spans a cut.
+    """
+    chunks, start = [], 0
+    while start < len(text):
+        m = _CUT_RE.search(text, max(start, start + chunk_chars - 1))
+        end = m.end() - 1 if m else len(text)
+        chunks.append(text[start:end])
+        start = end + 1
+    return chunks
+
+def split_parallel(text, lang, pool, min_len=2, chunk_chars=200_000, convert=False, store=False):
+    """
+    Sentence-split text across a process pool, one chunk per task (see paragraph_chunks).
+    With convert=True each chunk is first converted traditional -> simplified (OpenCC t2s).
+    Returns the concatenated sentence list in text order; with store=True it is a
+    SentenceStore, filled chunk by chunk. Cuts are forced sentence boundaries; they
+    only fall after lines ending in sentence punctuation (_SENT_END), so they rarely
+    differ from a single-call split (a Chinese line ending in '.' is one such case,
+    and punkt sees less context at chunk edges).
+    """
+    name = "English" if lang == "en" else "Chinese"
+    chunks = paragraph_chunks(text, chunk_chars)
+    logging.info(f"[{STAGE_TOKENIZE}] Tokenizing {name} text ({len(text)} chars) in {len(chunks)} chunks")
+    if convert:
+        chunks = list(pool.map(convert_t2s, chunks))
+    totals = []
+    def sentences():
+        for sents, n in pool.map(split_chunk, [lang] * len(chunks), chunks, [min_len] * len(chunks)):
+            totals.append(n)
+            yield from sents
+    filtered = SentenceStore.from_list(sentences()) if store else list(sentences())
+    total = sum(totals)
+    logging.info(f"[{STAGE_TOKENIZE}] Found {total} {name} sentences, {len(filtered)} after filtering")
     return filtered
 
+def split_chapters(text, chapters, lang, pool, min_len=2, chunk_chars=200_000, convert=False, store=False):
+    """
+    Like split_parallel, but split every chapter separately so no sentence
+    crosses a chapter boundary. Returns (sentences, bounds) where bounds[k]
+    is the (start, end) sentence range of chapters[k].
+    """
+    name = "English" if lang == "en" else "Chinese"
+    pieces, owners = [], []
+    for k, chapter in enumerate(chapters):
+        for piece in paragraph_chunks(text[chapter["start"]:chapter["end"]], chunk_chars):
+            pieces.append(piece)
+            owners.append(k)
+    logging.info(f"[{STAGE_TOKENIZE}] Tokenizing {name} text ({len(chapters)} chapters) in {len(pieces)} chunks")
+    if convert:
+        pieces = list(pool.map(convert_t2s, pieces))
+    counts = [0] * len(chapters)
+    def sentences():
+        results = pool.map(split_chunk, [lang] * len(pieces), pieces, [min_len] * len(pieces))
+        for k, (sents, _) in zip(owners, results):
+            counts[k] += len(sents)
+            yield from sents
+    sents = SentenceStore.from_list(sentences()) if store else list(sentences())
+    ends = np.cumsum(counts).tolist()
+    bounds = list(zip([0] + ends[:-1], ends))
+    logging.info(f"[{STAGE_TOKENIZE}] Found {len(sents)} {name} sentences after filtering")
+    return sents, bounds
+
 # ---------------- 句级对齐 -----------------
-def align_sentences(en_sents, zh_sents):
+def align_sentences(en_sents, zh_sents, en_embeddings=None, zh_embeddings=None, return_scores=False):
+    """
+    Align with Bertalign and return (en_idx, zh_idx) pairs; with return_scores
+    also return the DP score of each pair's bead (see bertalign.corelib.bead_scores).
+    """
     logging.info(f"[{STAGE_ALIGN}] Starting sentence alignment ({len(en_sents)} EN, {len(zh_sents)} ZH)")
     start_time = time.time()
     
+    from bertalign.aligner import Bertalign as Aligner
     try:
         aligner = Aligner(
-            src="\n".join(en_sents),
-            tgt="\n".join(zh_sents),
-            is_split=True
+            src=en_sents,
+            tgt=zh_sents,
+            is_split=True,
+            src_lang="en",
+            tgt_lang="zh",
+            src_embeddings=en_embeddings,
+            tgt_embeddings=zh_embeddings
         )
         
         aligner.align_sents()
         
         # Extract indices from alignment result with safety checks
-        valid_pairs = []
-        for item in aligner.result:
+        valid_pairs, valid_scores = [], []
+        for item, bead_score in zip(aligner.result, aligner.scores["score"]):
             if not item[0] or not item[1]:  # Skip if either source or target is empty
                 continue
                 
@@ -212,95 +354,413 @@ def align_sentences(en_sents, zh_sents):
             # Verify indices are within bounds
             if 0 <= en_idx < len(en_sents) and 0 <= zh_idx < len(zh_sents):
                 valid_pairs.append((en_idx, zh_idx))
+                valid_scores.append(float(bead_score))
             else:
                 logging.warning(f"[{STAGE_ALIGN}] Skipping out-of-bounds indices: EN={en_idx}, ZH={zh_idx}")
         
         logging.info(f"[{STAGE_ALIGN}] Alignment completed in {time.time() - start_time:.2f} seconds")
         logging.info(f"[{STAGE_ALIGN}] Found {len(valid_pairs)} valid sentence pairs")
+        if return_scores:
+            return valid_pairs, valid_scores
         return valid_pairs
     
     except Exception as e:
         logging.error(f"[{STAGE_ALIGN}] Alignment failed: {str(e)}")
         raise
 
+def align_by_chapters(en_sents, zh_sents, en_chapters, zh_chapters, en_bounds, zh_bounds,
+                      en_embeddings, zh_embeddings, workers=None):
+    """
+    Match chapters (bertalign.chapter) and align every matched chapter pair on
+    its own, in parallel. Returns (pairs, scores) with book-level indices,
+    like align_sentences(..., return_scores=True).
+    """
+    en_vecs, zh_vecs = en_embeddings[0], zh_embeddings[0]
+    beads = match_chapters(chapter_vectors(en_vecs[0], en_bounds), chapter_vectors(zh_vecs[0], zh_bounds),
+                           [c["end"] - c["start"] for c in en_chapters],
+                           [c["end"] - c["start"] for c in zh_chapters],
+                           [c["title"] for c in en_chapters], [c["title"] for c in zh_chapters],
+                           src_toc=[c.get("toc", False) for c in en_chapters],
+                           tgt_toc=[c.get("toc", False) for c in zh_chapters])
+    ranges = []
+    for en_chs, zh_chs in beads:
+        en_start, en_end = en_bounds[en_chs[0]][0], en_bounds[en_chs[-1]][1]
+        zh_start, zh_end = zh_bounds[zh_chs[0]][0], zh_bounds[zh_chs[-1]][1]
+        if min(en_end - en_start, zh_end - zh_start) >= ALIGN_MIN_CHAPTER_SENTS:
+            ranges.append((en_start, en_end, zh_start, zh_end))
+    logging.info(f"[{STAGE_ALIGN}] Matched {len(beads)} chapter pairs ({len(en_chapters)} EN, {len(zh_chapters)} ZH "
+                 f"chapters); aligning {len(ranges)} with >= {ALIGN_MIN_CHAPTER_SENTS} sentences per side")
+    
+    # Overlap embeddings at a chapter's first rows reach into the previous
+    # chapter, but the DP never uses an overlap longer than its position, so
+    # slicing the book-level embeddings is exact.
+    def sub(embeddings, start, end):
+        vecs, lens = embeddings
+        return np.ascontiguousarray(vecs[:, start:end]), np.ascontiguousarray(lens[:, start:end])
+    
+    # a SentenceStore slice would decode every sentence into a list; a view shares the buffer
+    def sents_range(sents, start, end):
+        return sents.view(start, end) if isinstance(sents, SentenceStore) else sents[start:end]
+    
+    def align_range(r):
+        en_start, en_end, zh_start, zh_end = r
+        pairs, scores = align_sentences(sents_range(en_sents, en_start, en_end), sents_range(zh_sents, zh_start, zh_end),
+                                        sub(en_embeddings, en_start, en_end), sub(zh_embeddings, zh_start, zh_end),
+                                        return_scores=True)
+        return [(i + en_start, j + zh_start) for i, j in pairs], scores
+    
+    # the DP kernels release the GIL (numba nogil), so threads align chapters in parallel
+    pairs, scores = [], []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for chapter_pairs, chapter_scores in pool.map(align_range, ranges):
+            pairs += chapter_pairs
+            scores += chapter_scores
+    logging.info(f"[{STAGE_ALIGN}] Found {len(pairs)} valid sentence pairs across chapters")
+    return pairs, scores
+
+# ---------------- Token 计数 ---------------
+def count_tokens(sents, tokenizer, cache, batch_size=1024):
+    """Return per-sentence token counts, tokenizing unseen sentences in batches.
+
+    Counts are stored in ``cache`` (sentence -> count) so sentences repeated
+    across pairs or calls are only tokenized once.
+    """
+    missing = [s for s in dict.fromkeys(sents) if s not in cache]
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i + batch_size]
+        enc = tokenizer(batch, add_special_tokens=False, return_attention_mask=False)
+        for s, ids in zip(batch, enc["input_ids"]):
+            cache[s] = len(ids)
+    return [cache[s] for s in sents]
+
+def record_token_lens(buf_en, buf_zh, tokenizer):
+    """Exact (input, output) token counts of the record write_chunk would write, with the prompt and special tokens."""
+    record = make_record(buf_en, buf_zh)
+    enc = tokenizer([ALPACA_PROMPT.format(**record), record["output"]], return_attention_mask=False)
+    return len(enc["input_ids"][0]), len(enc["input_ids"][1])
+
 # ---------------- 片段写出 -----------------
-def write_chunk(buf_en, buf_zh, fout):
-    record = {
+def make_record(buf_en, buf_zh):
+    return {
         "role": "",
         "instruction": "",
         "input": " ".join(buf_en),
         "output": "".join(buf_zh)
     }
-    fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def write_chunk(buf_en, buf_zh, writer):
+    writer.write(make_record(buf_en, buf_zh))
 
 # ---------------- 构建数据集 ---------------
-def build_dataset(en_txt_path, zh_txt_path, out_file, chunk_size, min_sent_len=2, use_opencc=False):
+def build_dataset(en_txt_path, zh_txt_path, out_file, chunk_size, min_sent_len=2, use_opencc=False,
+                  chunk_mode=CHUNK_MODE_CHARS, chunk_tokens=4096, tokenizer_name=DEFAULT_TOKENIZER,
+                  compression="none", shard_size=0, workers=None, split_chunk_chars=200_000,
+                  sentence_store=False, metrics=None, min_bead_score=None, chapter_align=False, align_workers=None,
+                  cascade=None):
     logging.info(f"[{STAGE_DATASET}] Building dataset from aligned sentences")
     start_time = time.time()
+    metrics = metrics or MetricsCollector("data")
+    book = Path(out_file).stem
     
     if use_opencc and OpenCC is None:
         logging.warning(f"[{STAGE_DATASET}] OpenCC not installed, skipping traditional-to-simplified conversion.")
         use_opencc = False
     
-    cc = OpenCC("t2s") if use_opencc and OpenCC else None
-    
-    # Load sentence transformer model
-    logging.info(f"[{STAGE_DATASET}] Loading sentence embedding model")
-    embed_model = SentenceTransformer("sentence-transformers/LaBSE")
+    if chunk_mode not in (CHUNK_MODE_CHARS, CHUNK_MODE_TOKENS):
+        raise ValueError(f"Unknown chunk_mode: {chunk_mode}")
     
     # Read text files
     en_txt = Path(en_txt_path).read_text(encoding="utf-8")
     zh_txt = Path(zh_txt_path).read_text(encoding="utf-8")
     
-    if cc:
-        logging.info(f"[{STAGE_DATASET}] Converting traditional to simplified Chinese")
-        zh_txt = cc.convert(zh_txt)
+    # Chapter boundaries written by epub_to_txt
+    en_chapters = zh_chapters = None
+    if chapter_align:
+        en_chapters, zh_chapters = load_chapters(en_txt_path), load_chapters(zh_txt_path)
+        if not en_chapters or not zh_chapters:
+            logging.warning(f"[{STAGE_ALIGN}] No chapter sidecar for {book}; aligning the whole book at once")
+            en_chapters = zh_chapters = None
     
-    # Split into sentences
-    en_sents = split_en(en_txt, min_len=min_sent_len)
-    zh_sents = split_zh(zh_txt, min_len=min_sent_len)
+    if use_opencc:
+        logging.info(f"[{STAGE_DATASET}] Converting traditional to simplified Chinese")
     
-    # Align sentences
-    pairs = align_sentences(en_sents, zh_sents)
+    def split_lang(text, lang, path, chapters, convert=False):
+        with metrics.stage("split", unit="sentences", book=book, lang=lang) as m:
+            if chapters:
+                sents, bounds = split_chapters(text, chapters, lang, pool, min_sent_len, split_chunk_chars,
+                                               convert, sentence_store)
+            else:
+                sents = split_parallel(text, lang, pool, min_sent_len, split_chunk_chars, convert, sentence_store)
+                bounds = None
+            m.items += len(sents)
+            m.bytes_read += Path(path).stat().st_size
+        return sents, bounds
+    
+    def encode_lang(sents, lang):
+        with metrics.stage("encode", unit="sentences", book=book, lang=lang) as m:
+            embeddings = bertalign.model.transform(sents, ALIGN_MAX_ALIGN - 1)
+            m.items += len(sents)
+        return embeddings
+    
+    # Split both languages concurrently; English embeddings are computed on a
+    # thread while the Chinese side is still being converted and split.
+    workers = workers or min(4, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_SPAWN) as pool, \
+            ThreadPoolExecutor(max_workers=1) as zh_thread:
+        zh_future = zh_thread.submit(split_lang, zh_txt, "zh", zh_txt_path, zh_chapters, use_opencc)
+        en_sents, en_bounds = split_lang(en_txt, "en", en_txt_path, en_chapters)
+        
+        logging.info(f"[{STAGE_ALIGN}] Embedding English sentences while Chinese is being split")
+        en_embeddings = encode_lang(en_sents, "en")
+        zh_sents, zh_bounds = zh_future.result()
+        zh_embeddings = encode_lang(zh_sents, "zh")
+    
+    # Align sentences, chapter by chapter when the EPUB structure is known
+    with metrics.stage("align", unit="pairs", book=book) as m:
+        if en_chapters:
+            pairs, scores = align_by_chapters(en_sents, zh_sents, en_chapters, zh_chapters, en_bounds, zh_bounds,
+                                              en_embeddings, zh_embeddings, align_workers)
+        else:
+            pairs, scores = align_sentences(en_sents, zh_sents, en_embeddings, zh_embeddings, return_scores=True)
+        m.items += len(pairs)
+    
+    tokenizer = None
+    if chunk_mode == CHUNK_MODE_TOKENS:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+    write_dataset(en_sents, zh_sents, pairs, out_file, chunk_size, min_sent_len=min_sent_len,
+                  chunk_mode=chunk_mode, chunk_tokens=chunk_tokens, tokenizer=tokenizer,
+                  compression=compression, shard_size=shard_size, metrics=metrics,
+                  pair_scores=scores, min_bead_score=min_bead_score, cascade=cascade)
+    logging.info(f"[{STAGE_DATASET}] Dataset built in {time.time() - start_time:.2f} seconds")
+
+def write_dataset(en_sents, zh_sents, pairs, out_file, chunk_size, min_sent_len=2,
+                  chunk_mode=CHUNK_MODE_CHARS, chunk_tokens=4096, tokenizer=None,
+                  compression="none", shard_size=0, metrics=None, pair_scores=None, min_bead_score=None,
+                  cascade=None):
+    """
+    Pack aligned pairs into chunks and write them as Alpaca JSONL; returns the chunk count.
+    With pair_scores (the aligner's bead scores, parallel to pairs) and
+    min_bead_score, low-confidence pairs are dropped before packing. With
+    pair_scores and a cascade_filter.CascadeFilter, the bead score stands in
+    for the cascade's cosine: it accepts or rejects the clear cases and
+    BERTScore decides the rest.
+    """
+    start_time = time.time()
+    metrics = metrics or MetricsCollector("data")
+    book = Path(out_file).stem
     
     if len(pairs) < min(len(en_sents), len(zh_sents)) * 0.5:
         logging.warning(f"[{STAGE_DATASET}] Alignment pairs ({len(pairs)}) are less than half of the shorter language's sentence count. Check data quality.")
     
+    # Drop low-confidence beads and pairs with a too-short side before packing
+    if pair_scores is None:
+        pair_scores = [None] * len(pairs)
+    kept, kept_scores, low_confidence = [], [], 0
+    for (en_idx, zh_idx), score in zip(pairs, pair_scores):
+        if score is not None and min_bead_score is not None and score < min_bead_score:
+            low_confidence += 1
+            continue
+        try:
+            es, zs = en_sents[en_idx], zh_sents[zh_idx]
+        except IndexError as e:
+            logging.error(f"[{STAGE_DATASET}] Index error at pair ({en_idx}, {zh_idx}): {str(e)}")
+            continue
+        if len(es.strip()) < min_sent_len or len(zs.strip()) < min_sent_len:
+            continue
+        kept.append((es, zs))
+        kept_scores.append(score)
+    if low_confidence:
+        logging.info(f"[{STAGE_DATASET}] Dropped {low_confidence} pairs with bead score below {min_bead_score}")
+    
+    # Quality cascade: the bead score decides the clear cases, BERTScore the rest
+    if cascade is not None and kept and None not in kept_scores:
+        with metrics.stage("quality_filter", unit="pairs", book=book) as m:
+            keep = cascade.filter([zs for _, zs in kept], [es for es, _ in kept], kept_scores)
+            m.items += len(keep)
+        kept = [pair for pair, k in zip(kept, keep) if k]
+        logging.info(f"[{STAGE_DATASET}] Quality filter kept {len(kept)} of {len(keep)} pairs "
+                     f"(bead score accept >= {cascade.accept_above:.3f}, reject < {cascade.reject_below:.3f})")
+    
+    # Per-pair sizes used for packing: Chinese characters, or token counts on both sides
+    if chunk_mode == CHUNK_MODE_TOKENS:
+        logging.info(f"[{STAGE_DATASET}] Counting tokens with {tokenizer.name_or_path} (target {chunk_tokens} tokens per side)")
+        with metrics.stage("tokenize", unit="sentences", book=book) as m:
+            cache = {}
+            en_sizes = count_tokens([es for es, _ in kept], tokenizer, cache)
+            zh_sizes = count_tokens([zs for _, zs in kept], tokenizer, cache)
+            m.items += 2 * len(kept)
+        budget = chunk_tokens
+        # prompt and special tokens of an empty record, added once per chunk
+        en_overhead, zh_overhead = record_token_lens([], [], tokenizer)
+    else:
+        en_sizes = [0] * len(kept)
+        zh_sizes = [len(zs) for _, zs in kept]
+        budget = chunk_size
+    
     # Build dataset chunks
     chunk_count = 0
-    buf_en, buf_zh, buf_len = [], [], 0
-    
-    with open(out_file, "w", encoding="utf-8") as fout, tqdm(total=len(pairs), desc=Path(out_file).stem) as bar:
-        for en_idx, zh_idx in pairs:
-            try:
-                es, zs = en_sents[en_idx], zh_sents[zh_idx]
-                
-                if len(es.strip()) < min_sent_len or len(zs.strip()) < min_sent_len:
-                    bar.update(1)
-                    continue
-                    
-                buf_en.append(es)
-                buf_zh.append(zs)
-                buf_len += len(zs)
-                bar.update(1)
-                
-                if buf_len >= chunk_size:
+    buf_en, buf_zh, buf_en_len, buf_len = [], [], 0, 0
+    
+    writer = JsonlWriter(out_file, compression=compression, shard_size=shard_size)
+    with metrics.stage("write", unit="records", book=book) as m, \
+            writer as fout, tqdm(total=len(pairs), desc=Path(out_file).stem) as bar:
+        bar.update(len(pairs) - len(kept))
+        for (es, zs), en_size, zh_size in zip(kept, en_sizes, zh_sizes):
+            if chunk_mode == CHUNK_MODE_TOKENS and buf_en:
+                # Close the chunk before a pair would push either side past the budget. The
+                # estimate is per-sentence counts plus the prompt; a join can merge or split
+                # about one token per boundary, so close calls are settled by tokenizing the record.
+                en_est = en_overhead + buf_en_len + en_size
+                zh_est = zh_overhead + buf_len + zh_size
+                slack = len(buf_en)
+                fits = max(en_est, zh_est) + slack <= budget
+                if not fits and max(en_est, zh_est) - slack <= budget:
+                    fits = max(record_token_lens(buf_en + [es], buf_zh + [zs], tokenizer)) <= budget
+                if not fits:
                     write_chunk(buf_en, buf_zh, fout)
                     chunk_count += 1
-                    buf_en, buf_zh, buf_len = [], [], 0
-            except IndexError as e:
-                logging.error(f"[{STAGE_DATASET}] Index error at pair ({en_idx}, {zh_idx}): {str(e)}")
-                bar.update(1)
-                continue
+                    buf_en, buf_zh, buf_en_len, buf_len = [], [], 0, 0
+            
+            buf_en.append(es)
+            buf_zh.append(zs)
+            buf_en_len += en_size
+            buf_len += zh_size
+            bar.update(1)
+            
+            if chunk_mode == CHUNK_MODE_CHARS and buf_len >= budget:
+                write_chunk(buf_en, buf_zh, fout)
+                chunk_count += 1
+                buf_en, buf_zh, buf_en_len, buf_len = [], [], 0, 0
         
         # Write the last chunk if it's substantial
-        if buf_en and buf_len > chunk_size * 0.3:
+        if buf_en and max(buf_en_len, buf_len) > budget * 0.3:
             write_chunk(buf_en, buf_zh, fout)
             chunk_count += 1
+    m.items += chunk_count
+    m.bytes_written += writer.bytes_written
     
     duration = time.time() - start_time
     logging.info(f"[{STAGE_DATASET}] Generated {chunk_count} chunks in {duration:.2f} seconds")
+    logging.info(f"[{STAGE_DATASET}] Wrote {writer.bytes_written} bytes in {len(writer.shards)} file(s) ({compression})")
     logging.info(f"[{STAGE_DATASET}] Finished writing Alpaca dataset to {out_file}")
+    return chunk_count
+
+# ---------------- 多书流水线 ---------------
+# Books flow through extract -> split -> encode -> align -> write stages that
+# run concurrently (see pipeline.py), so the encoder works on one book while
+# the next is still being parsed and the previous one is being written.
+DEFAULT_STAGE_WORKERS = {"extract": 2, "split": 1, "encode": 1, "align": 1, "write": 1}
+
+def convert_book(book):
+    """Convert a book's EPUBs to cleaned text, reusing text files newer than the EPUB."""
+    for lang in ("en", "zh"):
+        epub_path, txt_path = book[lang], book[f"{lang}_txt"]
+        if not Path(txt_path).exists() or Path(epub_path).stat().st_mtime > Path(txt_path).stat().st_mtime:
+            epub_to_txt(epub_path, txt_path, postprocess)
+        else:
+            logging.info(f"[{STAGE_EPUB_TO_TXT}] Using existing text file: {txt_path}")
+    return book
+
+def run_books_pipeline(books, out_dir, chunk_size, min_sent_len=2, use_opencc=False,
+                       chunk_mode=CHUNK_MODE_CHARS, chunk_tokens=4096, tokenizer_name=DEFAULT_TOKENIZER,
+                       compression="none", shard_size=0, workers=None, split_chunk_chars=200_000,
+                       stage_workers=None, queue_size=2, sentence_store=False, metrics=None,
+                       min_bead_score=None, chapter_align=False, align_workers=None, cascade=None):
+    """Build one Alpaca JSONL per {en, zh} EPUB pair with all stages overlapped across books."""
+    if use_opencc and OpenCC is None:
+        logging.warning(f"[{STAGE_DATASET}] OpenCC not installed, skipping traditional-to-simplified conversion.")
+        use_opencc = False
+    stage_workers = {**DEFAULT_STAGE_WORKERS, **(stage_workers or {})}
+    metrics = metrics or MetricsCollector("data")
+    tokenizer = None
+    if chunk_mode == CHUNK_MODE_TOKENS:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+    
+    items = []
+    for book in books:
+        en_stem, zh_stem = Path(book["en"]).stem, Path(book["zh"]).stem
+        items.append({
+            "name": f"{en_stem}_{zh_stem}",
+            "en": book["en"], "zh": book["zh"],
+            "en_txt": out_dir / f"{en_stem}_en.txt",
+            "zh_txt": out_dir / f"{zh_stem}_zh.txt",
+            "out_file": out_dir / f"{en_stem}_{zh_stem}_alpaca.jsonl",
+        })
+    
+    # extract runs EPUB parsing in its own process pool but waits on a thread,
+    # so the stage can be timed in this process
+    with ProcessPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1), mp_context=_SPAWN) as pool, \
+            ProcessPoolExecutor(max_workers=stage_workers["extract"], mp_context=_SPAWN) as extract_pool:
+        def extract_book(book):
+            with metrics.stage("extract", unit="books", book=book["name"]) as m:
+                book = extract_pool.submit(convert_book, book).result()
+                m.items += 1
+                m.bytes_read += sum(Path(book[lang]).stat().st_size for lang in ("en", "zh"))
+            return book
+        
+        def split_book(book):
+            chapters = {lang: load_chapters(book[f"{lang}_txt"]) if chapter_align else None for lang in ("en", "zh")}
+            if chapter_align and not all(chapters.values()):
+                logging.warning(f"[{STAGE_ALIGN}] No chapter sidecar for {book['name']}; aligning the whole book at once")
+                chapters = {"en": None, "zh": None}
+            for lang in ("en", "zh"):
+                with metrics.stage("split", unit="sentences", book=book["name"], lang=lang) as m:
+                    text = Path(book[f"{lang}_txt"]).read_text(encoding="utf-8")
+                    convert = use_opencc and lang == "zh"
+                    book[f"{lang}_chapters"] = chapters[lang]
+                    if chapters[lang]:
+                        book[f"{lang}_sents"], book[f"{lang}_bounds"] = split_chapters(
+                            text, chapters[lang], lang, pool, min_sent_len, split_chunk_chars, convert, sentence_store)
+                    else:
+                        book[f"{lang}_sents"] = split_parallel(text, lang, pool, min_sent_len, split_chunk_chars,
+                                                               convert, sentence_store)
+                    m.items += len(book[f"{lang}_sents"])
+                    m.bytes_read += Path(book[f"{lang}_txt"]).stat().st_size
+            return book
+        
+        def encode_book(book):
+            encoder = bertalign.model
+            for lang in ("en", "zh"):
+                with metrics.stage("encode", unit="sentences", book=book["name"], lang=lang) as m:
+                    book[f"{lang}_emb"] = encoder.transform(book[f"{lang}_sents"], ALIGN_MAX_ALIGN - 1)
+                    m.items += len(book[f"{lang}_sents"])
+            return book
+        
+        def align_book(book):
+            with metrics.stage("align", unit="pairs", book=book["name"]) as m:
+                if book["en_chapters"]:
+                    book["pairs"], book["scores"] = align_by_chapters(
+                        book["en_sents"], book["zh_sents"], book["en_chapters"], book["zh_chapters"],
+                        book["en_bounds"], book["zh_bounds"], book.pop("en_emb"), book.pop("zh_emb"), align_workers)
+                else:
+                    book["pairs"], book["scores"] = align_sentences(book["en_sents"], book["zh_sents"],
+                                                                    book.pop("en_emb"), book.pop("zh_emb"),
+                                                                    return_scores=True)
+                m.items += len(book["pairs"])
+            return book
+        
+        def write_book(book):
+            chunks = write_dataset(book["en_sents"], book["zh_sents"], book["pairs"], book["out_file"],
+                                   chunk_size, min_sent_len=min_sent_len, chunk_mode=chunk_mode,
+                                   chunk_tokens=chunk_tokens, tokenizer=tokenizer,
+                                   compression=compression, shard_size=shard_size, metrics=metrics,
+                                   pair_scores=book["scores"], min_bead_score=min_bead_score, cascade=cascade)
+            return book["out_file"], chunks
+        
+        pipe = Pipeline([
+            Stage("extract", extract_book, stage_workers["extract"], queue_size=queue_size),
+            Stage("split", split_book, stage_workers["split"], queue_size=queue_size),
+            Stage("encode", encode_book, stage_workers["encode"], queue_size=queue_size),
+            Stage("align", align_book, stage_workers["align"], queue_size=queue_size),
+            Stage("write", write_book, stage_workers["write"], queue_size=queue_size),
+        ])
+        results = pipe.run(items)
+    pipe.log_stats(STAGE_DATASET)
+    for out_file, chunks in results:
+        logging.info(f"[{STAGE_DATASET}] {out_file}: {chunks} chunks")
+    return results
 
 # ---------------- MAIN --------------------
 if __name__ == "__main__":
@@ -311,43 +771,104 @@ if __name__ == "__main__":
     
     # Load configuration
     config = load_config("parameter.yml")
-    en_epub = config["input_english_epub"]
-    zh_epub = config["input_chinese_epub"]
+    en_epub = config.get("input_english_epub")
+    zh_epub = config.get("input_chinese_epub")
     out_dir = Path(config["output_dir"])
     chunk_size = int(config.get("chunk_size", 8000))
     min_sent_len = int(config.get("min_sentence_length", 2))
     use_opencc = bool(config.get("use_opencc", False))
+    chunk_mode = config.get("chunk_mode", CHUNK_MODE_CHARS)
+    chunk_tokens = int(config.get("chunk_tokens", 4096))
+    tokenizer_name = config.get("tokenizer", DEFAULT_TOKENIZER)
+    compression = config.get("output_compression", "none")
+    shard_size = int(float(config.get("shard_size_mb", 0)) * 1024 * 1024)
+    workers = config.get("preprocess_workers")
+    split_chunk_chars = int(config.get("split_chunk_chars", 200_000))
+    sentence_store = bool(config.get("sentence_store", False))
+    min_bead_score = config.get("min_bead_score")
+    chapter_align = bool(config.get("chapter_align", False))
+    align_workers = config.get("align_workers")
+    metrics_prefix = config.get("metrics_prefix") or out_dir / "metrics"
+    metrics = MetricsCollector("data", labels={"config": "parameter.yml"})
+    bertalign.model_backend = config.get("encoder_backend", bertalign.model_backend)
+    bertalign.model_workers = int(config.get("encoder_workers") or bertalign.model_workers)
+    
+    # Optional BERTScore quality cascade over the bead scores (see cascade_filter.py)
+    cascade = None
+    if config.get("quality_min_f1") is not None:
+        from translation_evaluator import TranslationEvaluator
+        from cascade_filter import CascadeFilter
+        cascade = CascadeFilter(TranslationEvaluator(tier=config.get("quality_tier", "fast")),
+                                min_f1=float(config["quality_min_f1"]),
+                                sample_size=int(config.get("quality_sample", 1000)),
+                                max_error=float(config.get("quality_max_error", 0.02)))
     
     # Create output directory
     out_dir.mkdir(exist_ok=True)
     
-    # Define output paths
-    en_txt_path = out_dir / (Path(en_epub).stem + "_en.txt")
-    zh_txt_path = out_dir / (Path(zh_epub).stem + "_zh.txt")
-    
-    # Only convert EPUBs if text files don't exist or are outdated
-    en_needs_conversion = (not en_txt_path.exists() or 
-                          Path(en_epub).stat().st_mtime > en_txt_path.stat().st_mtime)
-    zh_needs_conversion = (not zh_txt_path.exists() or 
-                          Path(zh_epub).stat().st_mtime > zh_txt_path.stat().st_mtime)
-    
-    if en_needs_conversion:
-        logging.info(f"[{STAGE_EPUB_TO_TXT}] English EPUB needs conversion")
-        epub_to_txt(en_epub, en_txt_path, postprocess)
-    else:
-        logging.info(f"[{STAGE_EPUB_TO_TXT}] Using existing English text file: {en_txt_path}")
-    
-    if zh_needs_conversion:
-        logging.info(f"[{STAGE_EPUB_TO_TXT}] Chinese EPUB needs conversion")
-        epub_to_txt(zh_epub, zh_txt_path, postprocess)
+    # Several books: run every stage overlapped across books
+    books = config.get("books")
+    if books:
+        run_books_pipeline(books, out_dir, chunk_size,
+                           min_sent_len=min_sent_len, use_opencc=use_opencc,
+                           chunk_mode=chunk_mode, chunk_tokens=chunk_tokens, tokenizer_name=tokenizer_name,
+                           compression=compression, shard_size=shard_size,
+                           workers=workers, split_chunk_chars=split_chunk_chars,
+                           stage_workers=config.get("pipeline_workers"),
+                           queue_size=int(config.get("pipeline_queue_size", 2)),
+                           sentence_store=sentence_store, metrics=metrics,
+                           min_bead_score=min_bead_score, chapter_align=chapter_align,
+                           align_workers=align_workers, cascade=cascade)
     else:
-        logging.info(f"[{STAGE_EPUB_TO_TXT}] Using existing Chinese text file: {zh_txt_path}")
-    
-    # Output file uses both stems for clarity
-    out_file = out_dir / (f"{Path(en_epub).stem}_{Path(zh_epub).stem}_alpaca.jsonl")
-    
-    # Build the dataset
-    build_dataset(en_txt_path, zh_txt_path, out_file, chunk_size, 
-                 min_sent_len=min_sent_len, use_opencc=use_opencc)
-    
+        # Define output paths
+        en_txt_path = out_dir / (Path(en_epub).stem + "_en.txt")
+        zh_txt_path = out_dir / (Path(zh_epub).stem + "_zh.txt")
+    
+        # Only convert EPUBs if text files don't exist or are outdated
+        en_needs_conversion = (not en_txt_path.exists() or 
+                              Path(en_epub).stat().st_mtime > en_txt_path.stat().st_mtime)
+        zh_needs_conversion = (not zh_txt_path.exists() or 
+                              Path(zh_epub).stat().st_mtime > zh_txt_path.stat().st_mtime)
+    
+        # Convert both EPUBs concurrently
+        book = f"{Path(en_epub).stem}_{Path(zh_epub).stem}"
+        with metrics.stage("extract", unit="books", book=book) as m, ProcessPoolExecutor(max_workers=2, mp_context=_SPAWN) as pool:
+            futures = []
+            if en_needs_conversion:
+                logging.info(f"[{STAGE_EPUB_TO_TXT}] English EPUB needs conversion")
+                futures.append(pool.submit(epub_to_txt, en_epub, en_txt_path, postprocess))
+            else:
+                logging.info(f"[{STAGE_EPUB_TO_TXT}] Using existing English text file: {en_txt_path}")
+        
+            if zh_needs_conversion:
+                logging.info(f"[{STAGE_EPUB_TO_TXT}] Chinese EPUB needs conversion")
+                futures.append(pool.submit(epub_to_txt, zh_epub, zh_txt_path, postprocess))
+            else:
+                logging.info(f"[{STAGE_EPUB_TO_TXT}] Using existing Chinese text file: {zh_txt_path}")
+        
+            for future in futures:
+                future.result()
+            m.items += 1
+            m.bytes_read += Path(en_epub).stat().st_size + Path(zh_epub).stat().st_size
+    
+        # Output file uses both stems for clarity
+        out_file = out_dir / (f"{Path(en_epub).stem}_{Path(zh_epub).stem}_alpaca.jsonl")
+    
+        # Build the dataset
+        build_dataset(en_txt_path, zh_txt_path, out_file, chunk_size, 
+                     min_sent_len=min_sent_len, use_opencc=use_opencc,
+                     chunk_mode=chunk_mode, chunk_tokens=chunk_tokens, tokenizer_name=tokenizer_name,
+                     compression=compression, shard_size=shard_size,
+                     workers=workers, split_chunk_chars=split_chunk_chars,
+                     sentence_store=sentence_store, metrics=metrics,
+                     min_bead_score=min_bead_score, chapter_align=chapter_align,
+                     align_workers=align_workers, cascade=cascade)
+    
+    if cascade is not None:
+        s = cascade.stats
+        logging.info(f"[{STAGE_DATASET}] Quality filter: {s['accepted']} accepted / {s['rejected']} rejected by bead score, "
+                     f"{s['evaluated']} scored by BERTScore, {s['kept']} kept")
+    report = metrics.write(metrics_prefix)
+    logging.info(f"[{STAGE_COMPLETE}] Metrics written to {metrics_prefix}.json / .prom "
+                 f"(wall {report['wall_seconds']:.1f}s, peak RSS {(report['peak_rss_bytes'] or 0) / 2**20:.0f} MiB)")
     logging.info(f"[{STAGE_COMPLETE}] Process completed successfully")
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+dedup_pairs.py
+
+Streaming near-duplicate removal when merging per-book outputs
+(front matter, chapter headers, recurring epigraphs, ...).
+
+Usage:
+  python dedup_pairs.py \
+      --inputs book1_ds book2_ds ... \
+      --out ./en_zh_merged_ds \
+      [--threshold 0.8] [--table-bits N] [--capacity N]
+
+Inputs are either `en_zh_book_ds`-style dataset directories (one per book)
+or Alpaca JSONL files written by data.py; all inputs must be the same kind.
+Pairs are compared by MinHash over character 5-grams of the normalised
+"en | zh" text and looked up in an LSH index of fixed size: memory is
+bands * 2**table_bits * 16 bytes + capacity * num_perm * 4 bytes, however
+many pairs stream through. Unless given, both sizes follow the input row
+count when it is known (see index_size). The first occurrence of a pair is
+kept.
+"""
+
+import argparse
+import json
+import re
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from pipeline_metrics import MetricsCollector
+
+# ── 1. normalisation & MinHash ──────────────────────────────────────────────
+_PRIME = np.uint64((1 << 31) - 1)
+_MASK31 = np.uint64((1 << 31) - 1)
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_DIGITS_RE = re.compile(r"\d+")
+
+def normalize(text: str) -> str:
+    """Case-, width-, punctuation- and number-insensitive form of a text."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _DIGITS_RE.sub("0", text)          # "Chapter 3" ~ "Chapter 12"
+    return _NON_WORD_RE.sub(" ", text).strip()
+
+def pair_text(en: str, zh: str) -> str:
+    return normalize(en) + " | " + normalize(zh)
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+class MinHashLSH:
+    """
+    MinHash signatures plus a fixed-size LSH index.
+
+    Each band has a direct-mapped table of 2**table_bits slots (band key,
+    doc id); a colliding insert overwrites the older entry. Signatures of
+    the last `capacity` kept docs are held in a ring buffer and used to
+    verify candidates, so a hit counts only when the estimated Jaccard
+    similarity is >= threshold.
+    """
+
+    def __init__(self, num_perm=64, bands=16, table_bits=18, capacity=200_000,
+                 threshold=0.8, shingle=5, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle = shingle
+        self.table_mask = np.uint64((1 << table_bits) - 1)
+        self.table_keys = np.zeros((bands, 1 << table_bits), dtype=np.uint64)
+        self.table_ids = np.full((bands, 1 << table_bits), -1, dtype=np.int64)
+        self.capacity = capacity
+        self.sigs = np.zeros((capacity, num_perm), dtype=np.uint32)
+        self.sig_ids = np.full(capacity, -1, dtype=np.int64)
+        self.next_id = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        cp = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = min(self.shingle, len(cp)) or 1
+        if len(cp) == 0:
+            cp = np.zeros(1, dtype=np.uint64)
+        h = np.zeros(len(cp) - n + 1, dtype=np.uint64)
+        for k in range(n):                     # polynomial rolling hash of every n-gram
+            h = h * np.uint64(1000003) + cp[k:len(cp) - n + 1 + k]
+        x = np.unique(_splitmix64(h) & _MASK31)
+        return ((self.a[:, None] * x[None, :] + self.b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, sigs: np.ndarray) -> np.ndarray:
+        rows = sigs.reshape(len(sigs), self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros((len(sigs), self.bands), dtype=np.uint64)
+        for r in range(self.rows):
+            keys = _splitmix64(keys ^ rows[:, :, r])
+        return keys | np.uint64(1)             # 0 marks an empty table slot
+
+    def _similar(self, sig: np.ndarray, doc_ids) -> bool:
+        for doc_id in doc_ids:
+            slot = doc_id % self.capacity
+            if doc_id >= 0 and self.sig_ids[slot] == doc_id:
+                if np.mean(self.sigs[slot] == sig) >= self.threshold:
+                    return True
+        return False
+
+    def dedup_batch(self, texts) -> np.ndarray:
+        """Return a keep mask for a batch and add the kept texts to the index."""
+        if not texts:
+            return np.zeros(0, dtype=bool)
+        sigs = np.stack([self.signature(t) for t in texts])
+        keys = self._band_keys(sigs)
+        pos = (keys & self.table_mask).astype(np.int64)
+        band = np.arange(self.bands)
+        hit = self.table_keys[band, pos] == keys
+        cand = np.where(hit, self.table_ids[band, pos], -1)
+
+        keep = np.ones(len(texts), dtype=bool)
+        local = {}                             # (band, key) -> row within this batch
+        for i in range(len(texts)):
+            if (cand[i] >= 0).any() and self._similar(sigs[i], cand[i][cand[i] >= 0]):
+                keep[i] = False
+                continue
+            rows = {local[k] for k in zip(band.tolist(), keys[i].tolist()) if k in local}
+            if any(np.mean(sigs[j] == sigs[i]) >= self.threshold for j in rows):
+                keep[i] = False
+                continue
+            for k in zip(band.tolist(), keys[i].tolist()):
+                local.setdefault(k, i)
+
+        kept = np.flatnonzero(keep)
+        ids = self.next_id + np.arange(len(kept), dtype=np.int64)
+        self.next_id += len(kept)
+        slots = ids % self.capacity
+        self.sigs[slots] = sigs[kept]
+        self.sig_ids[slots] = ids
+        for b in range(self.bands):
+            self.table_keys[b, pos[kept, b]] = keys[kept, b]
+            self.table_ids[b, pos[kept, b]] = ids
+        return keep
+
+def index_size(num_rows):
+    """
+    (table_bits, capacity) for about num_rows pairs: two table slots per pair
+    and a signature for every kept pair, within 2**10..2**22 slots and
+    1024..2M signatures. Unknown row count: (18, 200_000).
+    """
+    if num_rows is None:
+        return 18, 200_000
+    table_bits = min(22, max(10, int(num_rows).bit_length() + 1))
+    return table_bits, min(2_000_000, max(1024, int(num_rows)))
+
+def index_bytes(bands, table_bits, capacity, num_perm):
+    return bands * (1 << table_bits) * 16 + capacity * num_perm * 4
+
+# ── 2. readers / writers for both dataset kinds ─────────────────────────────
+def _is_hf_dataset(path: Path) -> bool:
+    return (path / "dataset_dict.json").exists()
+
+def _tree_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+def count_rows(inputs):
+    """Total pairs in the inputs, or None when a JSONL file is compressed without an index."""
+    if all(_is_hf_dataset(p) for p in inputs):
+        from datasets import load_from_disk
+        return sum(sum(ds.num_rows for ds in load_from_disk(str(p)).values()) for p in inputs)
+    from jsonl_writer import read_index
+    total = 0
+    for path in inputs:
+        if Path(str(path) + ".idx").exists():
+            total += sum(count for *_, count in read_index(path))
+        elif path.suffix == ".jsonl":
+            with open(path, "rb") as f:
+                total += sum(1 for line in f if line.strip())
+        else:
+            return None
+    return total
+
+def dedup_hf(inputs, out: Path, lsh: MinHashLSH, batch_size: int, shard_rows: int):
+    from datasets import load_from_disk
+    from build_en_zh_dataset import ArrowShardWriter
+
+    report, writers = {}, {}
+    for path in inputs:
+        dsd = load_from_disk(str(path))
+        stats = report.setdefault(Path(path).name, {"pairs": 0, "removed": 0})
+        for split in dsd:
+            if split not in writers:
+                writers[split] = ArrowShardWriter(out / split, features=dsd[split].features,
+                                                  shard_rows=shard_rows)
+            for batch in dsd[split].iter(batch_size=batch_size):
+                keep = lsh.dedup_batch([pair_text(e, z) for e, z in zip(batch["en"], batch["zh"])])
+                idx = np.flatnonzero(keep)
+                writers[split].write_batch({k: [v[i] for i in idx] for k, v in batch.items()})
+                stats["pairs"] += len(keep)
+                stats["removed"] += int((~keep).sum())
+        print(f"🔹 {Path(path).name}: removed {stats['removed']} of {stats['pairs']} pairs")
+    for writer in writers.values():
+        writer.close()
+    (out / "dataset_dict.json").write_text(json.dumps({"splits": list(writers)}), encoding="utf-8")
+    return report
+
+def dedup_jsonl(inputs, out: Path, lsh: MinHashLSH, batch_size: int, compression: str):
+    from jsonl_writer import JsonlWriter, iter_jsonl
+
+    report = {}
+    with JsonlWriter(out / "deduped_alpaca.jsonl", compression=compression) as writer:
+        for path in inputs:
+            stats = report.setdefault(Path(path).name, {"pairs": 0, "removed": 0})
+            batch = []
+            for record in iter_jsonl(path):
+                batch.append(record)
+                if len(batch) == batch_size:
+                    _write_kept(batch, lsh, writer, stats)
+                    batch = []
+            _write_kept(batch, lsh, writer, stats)
+            print(f"🔹 {Path(path).name}: removed {stats['removed']} of {stats['pairs']} pairs")
+    return report
+
+def _write_kept(batch, lsh, writer, stats):
+    keep = lsh.dedup_batch([pair_text(r["input"], r["output"]) for r in batch])
+    for record, k in zip(batch, keep):
+        if k:
+            writer.write(record)
+    stats["pairs"] += len(batch)
+    stats["removed"] += int((~keep).sum())
+
+# ── 3. main ──────────────────────────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description="MinHash/LSH near-duplicate removal across books")
+    parser.add_argument("--inputs", nargs="+", required=True, help="dataset dirs or Alpaca JSONL files, one per book")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--threshold", type=float, default=0.8, help="estimated Jaccard similarity counted as duplicate")
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--table-bits", type=int, default=None,
+                        help="log2 slots per LSH band table; default from the input row count "
+                             "(2 slots per pair, 10..22), 18 if unknown. Tables take bands * 2**bits * 16 bytes: "
+                             "16 MiB at 16, 64 MiB at 18, 1 GiB at 22 with 16 bands")
+    parser.add_argument("--capacity", type=int, default=None,
+                        help="signatures kept for verification; default the input row count (1024..2M), "
+                             "200000 if unknown. Takes capacity * num_perm * 4 bytes: 49 MiB for 200000 at 64 perms")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--shard-rows", type=int, default=100_000)
+    parser.add_argument("--compression", default="none", help="JSONL output compression: none | gzip | zstd")
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    inputs = [Path(p) for p in args.inputs]
+    table_bits, capacity = args.table_bits, args.capacity
+    if table_bits is None or capacity is None:
+        auto_bits, auto_capacity = index_size(count_rows(inputs))
+        table_bits = auto_bits if table_bits is None else table_bits
+        capacity = auto_capacity if capacity is None else capacity
+    print(f"🔹 LSH index: 2**{table_bits} slots x {args.bands} bands, {capacity} signatures "
+          f"({index_bytes(args.bands, table_bits, capacity, args.num_perm) / 2**20:.0f} MiB)")
+    lsh = MinHashLSH(num_perm=args.num_perm, bands=args.bands, table_bits=table_bits,
+                     capacity=capacity, threshold=args.threshold)
+
+    metrics = MetricsCollector("dedup")
+    with metrics.stage("dedup", unit="pairs") as m:
+        if all(_is_hf_dataset(p) for p in inputs):
+            report = dedup_hf(inputs, out, lsh, args.batch_size, args.shard_rows)
+        elif not any(_is_hf_dataset(p) for p in inputs):
+            report = dedup_jsonl(inputs, out, lsh, args.batch_size, args.compression)
+        else:
+            raise ValueError("Inputs mix dataset directories and JSONL files")
+        m.items += sum(s["pairs"] for s in report.values())
+        m.bytes_read += sum(_tree_size(p) for p in inputs)
+        m.bytes_written += _tree_size(out)
+
+    total = sum(s["pairs"] for s in report.values())
+    removed = sum(s["removed"] for s in report.values())
+    (out / "dedup_report.json").write_text(
+        json.dumps({"books": report, "pairs": total, "removed": removed}, ensure_ascii=False, indent=2),
+        encoding="utf-8")
+    metrics.write(out / "metrics")
+    print(f"✅ Removed {removed} of {total} pairs; report: {out / 'dedup_report.json'}")
+
+if __name__ == "__main__":
+    main()
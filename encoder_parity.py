@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+encoder_parity.py
+
+Check that a faster encoder backend (int8 quantized / ONNX Runtime) gives
+the same embeddings and alignments as the full-precision PyTorch model.
+
+Usage:
+  python encoder_parity.py --backend quantized \
+      --src english_sample.txt --tgt chinese_sample.txt \
+      [--gold gold_alignment.txt] [--model LaBSE]
+
+Reports per-sentence embedding cosine (reference vs candidate backend),
+encoding time of both backends and alignment F1 via bertalign.eval. The
+reference alignment is the torch backend's output unless --gold is given.
+Exits with status 1 when a threshold is not met.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bertalign.aligner import Bertalign
+from bertalign.encoder import BACKENDS, Encoder
+from bertalign.eval import log_final_scores, read_alignments, score_multiple
+from bertalign.utils import clean_text, split_sents
+
+
+def encode(encoder, src_sents, tgt_sents, num_overlaps):
+    start = time.time()
+    src = encoder.transform(src_sents, num_overlaps)
+    tgt = encoder.transform(tgt_sents, num_overlaps)
+    return src, tgt, time.time() - start
+
+
+def row_cosine(a, b):
+    a = a.reshape(-1, a.shape[-1])
+    b = b.reshape(-1, b.shape[-1])
+    num = np.sum(a * b, axis=1)
+    den = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return num / np.maximum(den, 1e-12)
+
+
+def align(src_sents, tgt_sents, args, src_emb, tgt_emb):
+    aligner = Bertalign("\n".join(src_sents), "\n".join(tgt_sents),
+                        max_align=args.max_align, is_split=True,
+                        src_lang=args.src_lang, tgt_lang=args.tgt_lang,
+                        src_embeddings=src_emb, tgt_embeddings=tgt_emb)
+    aligner.align_sents()
+    return aligner.result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding / alignment parity of encoder backends")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "torch"], required=True)
+    parser.add_argument("--model", default="LaBSE")
+    parser.add_argument("--src", default="english_sample.txt")
+    parser.add_argument("--tgt", default="chinese_sample.txt")
+    parser.add_argument("--src-lang", default="en")
+    parser.add_argument("--tgt-lang", default="zh")
+    parser.add_argument("--gold", help="gold alignment file (bertalign.eval format)")
+    parser.add_argument("--max-align", type=int, default=5)
+    parser.add_argument("--min-cosine", type=float, default=0.98,
+                        help="fail if the mean embedding cosine is below this")
+    parser.add_argument("--max-f1-drop", type=float, default=0.02,
+                        help="fail if strict F1 drops by more than this")
+    args = parser.parse_args()
+
+    with open(args.src, encoding="utf-8") as f:
+        src_sents = split_sents(clean_text(f.read()), args.src_lang)
+    with open(args.tgt, encoding="utf-8") as f:
+        tgt_sents = split_sents(clean_text(f.read()), args.tgt_lang)
+    num_overlaps = args.max_align - 1
+    print(f"{len(src_sents)} source / {len(tgt_sents)} target sentences")
+
+    ref_src, ref_tgt, ref_time = encode(Encoder(args.model, "torch"), src_sents, tgt_sents, num_overlaps)
+    cand_src, cand_tgt, cand_time = encode(Encoder(args.model, args.backend), src_sents, tgt_sents, num_overlaps)
+
+    cos = np.concatenate([row_cosine(ref_src[0], cand_src[0]), row_cosine(ref_tgt[0], cand_tgt[0])])
+    print(f"Embedding cosine ({args.backend} vs torch): mean {cos.mean():.4f}, min {cos.min():.4f}")
+    print(f"Encoding time: torch {ref_time:.2f}s, {args.backend} {cand_time:.2f}s "
+          f"(x{ref_time / max(cand_time, 1e-9):.2f})")
+
+    ref_align = align(src_sents, tgt_sents, args, ref_src, ref_tgt)
+    cand_align = align(src_sents, tgt_sents, args, cand_src, cand_tgt)
+    gold = read_alignments(args.gold) if args.gold else ref_align
+
+    ref_res = score_multiple(gold_list=[gold], test_list=[ref_align])
+    cand_res = score_multiple(gold_list=[gold], test_list=[cand_align])
+    print("torch:", file=sys.stderr)
+    log_final_scores(ref_res)
+    print(f"{args.backend}:", file=sys.stderr)
+    log_final_scores(cand_res)
+
+    failed = False
+    if cos.mean() < args.min_cosine:
+        print(f"FAIL: mean cosine {cos.mean():.4f} < {args.min_cosine}")
+        failed = True
+    f1_drop = ref_res["f1_strict"] - cand_res["f1_strict"]
+    if f1_drop > args.max_f1_drop:
+        print(f"FAIL: strict F1 dropped by {f1_drop:.3f} (> {args.max_f1_drop})")
+        failed = True
+    if not failed:
+        print("OK: backend within parity thresholds")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+翻译质量评估服务 - 常驻进程，保持BERTScore模型加载
+
+服务端:
+  python evaluator_server.py serve [--port 8765] [--max-batch 64] [--max-wait-ms 20]
+
+客户端:
+  python evaluator_server.py score --chinese "..." --english "..."
+  python evaluator_server.py score --chinese-file zh.txt --english-file en.txt [--long-text]
+
+HTTP接口 (仅监听localhost):
+  POST /score  {"pairs": [{"chinese": "...", "english": "..."}, ...], "long": false}
+  GET  /health
+并发请求由后台线程合并成微批次(最多max_batch对，首个请求最多等待max_wait_ms)
+后统一调用evaluate_batch。
+"""
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+
+
+class MicroBatcher:
+    """把并发请求合并成批次交给TranslationEvaluator，模型只在这一个线程里运行"""
+
+    def __init__(self, evaluator, max_batch=64, max_wait_ms=20, batch_size=64):
+        self.evaluator = evaluator
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="evaluator-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, pairs, long=False):
+        """提交若干(中文, 英文)对，返回Future，结果为每对的分数字典列表"""
+        future = Future()
+        self._queue.put((pairs, long, future))
+        return future
+
+    def _run(self):
+        while True:
+            requests = [self._queue.get()]
+            num_pairs = len(requests[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while num_pairs < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(item)
+                num_pairs += len(item[0])
+            self._process(requests)
+
+    def _process(self, requests):
+        short = [r for r in requests if not r[1]]
+        for pairs, _, future in (r for r in requests if r[1]):
+            # 长文本请求本身已分段批量评分，逐个处理
+            try:
+                future.set_result([self.evaluator.evaluate_long(zh, en, batch_size=self.batch_size)
+                                   for zh, en in pairs])
+            except Exception as e:
+                future.set_exception(e)
+        if not short:
+            return
+        try:
+            all_pairs = [pair for pairs, _, _ in short for pair in pairs]
+            scores = self.evaluator.evaluate_batch([zh for zh, _ in all_pairs], [en for _, en in all_pairs],
+                                                   batch_size=self.batch_size)
+        except Exception as e:
+            for _, _, future in short:
+                future.set_exception(e)
+            return
+        start = 0
+        for pairs, _, future in short:
+            results = []
+            for i in range(start, start + len(pairs)):
+                f1 = float(scores["f1"][i])
+                results.append({
+                    "precision": float(scores["precision"][i]),
+                    "recall": float(scores["recall"][i]),
+                    "f1": f1,
+                    "normalized_f1": (f1 + 1) / 2
+                })
+            future.set_result(results)
+            start += len(pairs)
+
+
+def make_handler(batcher, evaluator):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok"})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/score":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                pairs = [(p["chinese"], p["english"]) for p in body["pairs"]]
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": f"请求格式错误: {e}"})
+                return
+            try:
+                results = batcher.submit(pairs, long=bool(body.get("long"))).result()
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            for r in results:
+                r["rating"] = evaluator.interpret_score(r["f1"])
+            self._reply(200, {"results": results})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(args):
+    from translation_evaluator import TranslationEvaluator
+
+    evaluator = TranslationEvaluator(model_type=args.model_type, ref_cache_size=args.ref_cache_size,
+                                     tier=args.tier)
+    batcher = MicroBatcher(evaluator, args.max_batch, args.max_wait_ms, args.batch_size)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(batcher, evaluator))
+    print(f"评估服务已启动: http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def score(args):
+    if args.chinese_file and args.english_file:
+        with open(args.chinese_file, 'r', encoding='utf-8') as f:
+            chinese_text = f.read().strip()
+        with open(args.english_file, 'r', encoding='utf-8') as f:
+            english_text = f.read().strip()
+    elif args.chinese and args.english:
+        chinese_text, english_text = args.chinese, args.english
+    else:
+        print("错误: 必须同时提供中文和英文文本(或文件)")
+        sys.exit(1)
+
+    body = json.dumps({"pairs": [{"chinese": chinese_text, "english": english_text}],
+                       "long": args.long_text}, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(f"http://127.0.0.1:{args.port}/score", data=body,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=args.timeout) as resp:
+            results = json.loads(resp.read())["results"][0]
+    except urllib.error.HTTPError as e:
+        # 服务在运行，但拒绝或处理失败了这个请求
+        detail = e.read().decode("utf-8", errors="replace")
+        try:
+            detail = json.loads(detail).get("error", detail)
+        except ValueError:
+            pass
+        print(f"评估服务返回错误 {e.code} {e.reason}: {detail}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"无法连接评估服务: {e}")
+        print(f"请先启动服务: python evaluator_server.py serve --port {args.port}")
+        sys.exit(1)
+
+    print("\n评估结果:")
+    print(f"精确度 (Precision): {results['precision']:.4f}")
+    print(f"召回率 (Recall): {results['recall']:.4f}")
+    print(f"F1分数 (F1-Score): {results['f1']:.4f}")
+    print(f"质量评级: {results['rating']}")
+
+
+def main():
+    from translation_evaluator import TIERS
+
+    parser = argparse.ArgumentParser(description="常驻BERTScore翻译质量评估服务")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="启动评估服务")
+    p_serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_serve.add_argument("--model-type", default=None, help="覆盖档位对应的模型")
+    p_serve.add_argument("--tier", default="accurate", choices=list(TIERS), help="速度/精度档位")
+    p_serve.add_argument("--max-batch", type=int, default=64, help="每个微批次最多的句对数量")
+    p_serve.add_argument("--max-wait-ms", type=float, default=20, help="首个请求最长等待合批时间(毫秒)")
+    p_serve.add_argument("--batch-size", type=int, default=64, help="每次前向计算的句对数量")
+    p_serve.add_argument("--ref-cache-size", type=int, default=10000, help="参考译文词向量缓存条数")
+
+    p_score = sub.add_parser("score", help="向评估服务提交一对文本")
+    p_score.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_score.add_argument("--chinese", type=str, help="中文文本")
+    p_score.add_argument("--english", type=str, help="英文文本")
+    p_score.add_argument("--chinese-file", type=str, help="包含中文文本的文件路径")
+    p_score.add_argument("--english-file", type=str, help="包含英文文本的文件路径")
+    p_score.add_argument("--long-text", action="store_true", help="长文本模式: 分段对齐后评分")
+    p_score.add_argument("--timeout", type=float, default=600)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        score(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+jsonl_writer.py
+
+Buffered JSONL output for the dataset scripts.
+
+Records are grouped into blocks, serialized (orjson when installed) and
+written by a background thread, so the producer only pays for a list
+append. Each block is compressed independently (gzip member / zstd frame),
+which keeps concatenated shards readable by the standard tools and lets the
+offset index point straight at a block.
+
+Index format (``<path>.idx``, tab separated, one line per block):
+    shard  block_offset  block_bytes  first_record  num_records
+"""
+
+import gzip
+import json
+import queue
+import threading
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_SUFFIX = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+INDEX_HEADER = "shard\tblock_offset\tblock_bytes\tfirst_record\tnum_records\n"
+
+
+def dumps_line(record) -> bytes:
+    """Serialize one record to a UTF-8 JSON line."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def loads_line(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def _compressor(compression, level):
+    if compression == "none":
+        return lambda data: data
+    if compression == "gzip":
+        return lambda data: gzip.compress(data, compresslevel=level or 6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires the 'zstandard' package")
+        cctx = zstandard.ZstdCompressor(level=level or 3)
+        return cctx.compress
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _decompressor(compression):
+    if compression == "none":
+        return lambda data: data
+    if compression == "gzip":
+        return gzip.decompress
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd decompression requires the 'zstandard' package")
+        dctx = zstandard.ZstdDecompressor()
+        return lambda data: dctx.decompress(data)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _compression_of(path):
+    for name, suffix in COMPRESSION_SUFFIX.items():
+        if suffix and str(path).endswith(suffix):
+            return name
+    return "none"
+
+
+class JsonlWriter:
+    """
+    Buffered, optionally compressed and sharded JSONL writer.
+
+    Args:
+        path: output path without compression suffix, e.g. ``out/book.jsonl``.
+        compression: "none", "gzip" or "zstd".
+        shard_size: maximum uncompressed bytes per shard, 0 for a single file.
+        block_records: records per block handed to the writer thread.
+        max_pending: blocks queued before ``write`` blocks (backpressure).
+        level: compression level, None for the codec default.
+
+    Records must not be mutated after ``write``; they are serialized later
+    on the writer thread.
+    """
+
+    def __init__(self, path, compression="none", shard_size=0,
+                 block_records=1024, max_pending=8, level=None):
+        self.path = Path(path)
+        self.compression = compression
+        self.shard_size = int(shard_size)
+        self.block_records = block_records
+        self.num_records = 0
+        self.bytes_written = 0
+        self.shards = []
+
+        self._compress = _compressor(compression, level)
+        self._block = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._fout = None
+        self._shard_raw_bytes = 0
+        self._shard_offset = 0
+        self._index = open(str(self.path) + ".idx", "w", encoding="utf-8")
+        self._index.write(INDEX_HEADER)
+        self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._thread.start()
+
+    # ---- producer side ----
+    def write(self, record):
+        self._check()
+        self._block.append(record)
+        if len(self._block) >= self.block_records:
+            self._submit()
+
+    def close(self):
+        if self._thread is None:
+            return
+        if self._block:
+            self._submit()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._fout is not None:
+            self._fout.close()
+        self._index.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _submit(self):
+        block, self._block = self._block, []
+        first = self.num_records
+        self.num_records += len(block)
+        self._queue.put((first, block))
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError(f"JSONL writer failed for {self.path}") from self._error
+
+    # ---- writer thread ----
+    def _shard_path(self, shard_id):
+        suffix = COMPRESSION_SUFFIX[self.compression]
+        if not self.shard_size:
+            return Path(str(self.path) + suffix)
+        return self.path.with_name(f"{self.path.stem}-{shard_id:05d}{self.path.suffix}{suffix}")
+
+    def _open_shard(self):
+        if self._fout is not None:
+            self._fout.close()
+        shard_path = self._shard_path(len(self.shards))
+        self.shards.append(shard_path)
+        self._fout = open(shard_path, "wb")
+        self._shard_raw_bytes = 0
+        self._shard_offset = 0
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                first, block = item
+                raw = b"".join(dumps_line(r) for r in block)
+                if (self._fout is None or
+                        (self.shard_size and self._shard_raw_bytes and
+                         self._shard_raw_bytes + len(raw) > self.shard_size)):
+                    self._open_shard()
+                data = self._compress(raw)
+                self._fout.write(data)
+                self._index.write(f"{self.shards[-1].name}\t{self._shard_offset}\t"
+                                  f"{len(data)}\t{first}\t{len(block)}\n")
+                self._shard_offset += len(data)
+                self._shard_raw_bytes += len(raw)
+                self.bytes_written += len(data)
+        except BaseException as e:  # surfaced to the producer on the next call
+            self._error = e
+            # keep draining so the producer never blocks on a full queue
+            while self._queue.get() is not None:
+                pass
+
+
+def read_index(path):
+    """Read the block index written next to ``path``."""
+    blocks = []
+    with open(str(path) + ".idx", "r", encoding="utf-8") as f:
+        next(f)
+        for line in f:
+            shard, offset, nbytes, first, count = line.rstrip("\n").split("\t")
+            blocks.append((shard, int(offset), int(nbytes), int(first), int(count)))
+    return blocks
+
+
+def iter_jsonl(path, start=0):
+    """
+    Yield records written by ``JsonlWriter`` (or any plain JSONL file),
+    starting at record number ``start``. Uses the index to skip whole blocks.
+    """
+    path = Path(path)
+    index_path = Path(str(path) + ".idx")
+    if not index_path.exists():
+        with open(path, "rb") as f:
+            for i, line in enumerate(f):
+                if i >= start and line.strip():
+                    yield loads_line(line)
+        return
+
+    handles = {}
+    try:
+        for shard, offset, nbytes, first, count in read_index(path):
+            if first + count <= start:
+                continue
+            if shard not in handles:
+                handles[shard] = open(path.parent / shard, "rb")
+            f = handles[shard]
+            f.seek(offset)
+            lines = _decompressor(_compression_of(shard))(f.read(nbytes)).splitlines()
+            for i, line in enumerate(lines, first):
+                if i >= start:
+                    yield loads_line(line)
+    finally:
+        for f in handles.values():
+            f.close()
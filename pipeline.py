@@ -0,0 +1,164 @@
+"""
+pipeline.py
+
+Overlapped producer/consumer runner for multi-stage jobs.
+
+Each stage is a function item -> item run by its own worker threads (or a
+process pool for CPU-bound Python code). Stages are connected by bounded
+queues, so a fast stage blocks once the queue to a slow one is full
+(backpressure) instead of buffering whole books in memory, and a slow stage
+(e.g. the encoder) always has its next item ready while upstream stages
+work ahead.
+
+    pipe = Pipeline([
+        Stage("extract", convert_book, workers=2, processes=True),
+        Stage("encode", encode_book),
+        Stage("write", write_book),
+    ])
+    results = pipe.run(books)
+
+A stage returning None drops the item. The first exception in any stage
+stops the pipeline and is re-raised from ``run``.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+_DONE = object()
+_POLL = 0.1
+
+
+class Stage:
+    """
+    Args:
+        name: used in logs and errors.
+        fn: callable applied to every item; must be picklable if processes=True.
+        workers: concurrent workers (threads, or processes with processes=True).
+        processes: run fn in a process pool instead of the worker threads.
+        queue_size: capacity of the queue feeding this stage.
+    """
+
+    def __init__(self, name, fn, workers=1, processes=False, queue_size=2):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.processes = processes
+        self.queue_size = max(1, int(queue_size))
+        self.items = 0
+        self.busy = 0.0      # summed worker seconds spent in fn
+        self.wait = 0.0      # summed worker seconds spent waiting for input
+
+
+class Pipeline:
+    def __init__(self, stages):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = list(stages)
+
+    def run(self, items):
+        """Push items through every stage; return the last stage's outputs in completion order."""
+        stages = self.stages
+        stop = threading.Event()
+        lock = threading.Lock()
+        errors = []
+        queues = [queue.Queue(maxsize=s.queue_size) for s in stages] + [queue.Queue()]
+        remaining = [s.workers for s in stages]
+        executors = {i: ProcessPoolExecutor(max_workers=s.workers)
+                     for i, s in enumerate(stages) if s.processes}
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=_POLL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=_POLL)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def fail(name, e):
+            with lock:
+                errors.append((name, e))
+            stop.set()
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(queues[0], item):
+                        return
+                for _ in range(stages[0].workers):
+                    put(queues[0], _DONE)
+            except BaseException as e:
+                fail("input", e)
+
+        def work(i):
+            stage = stages[i]
+            try:
+                while True:
+                    t0 = time.perf_counter()
+                    item = get(queues[i])
+                    t1 = time.perf_counter()
+                    if item is _DONE:
+                        break
+                    if stage.processes:
+                        result = executors[i].submit(stage.fn, item).result()
+                    else:
+                        result = stage.fn(item)
+                    with lock:
+                        stage.items += 1
+                        stage.wait += t1 - t0
+                        stage.busy += time.perf_counter() - t1
+                    if result is not None and not put(queues[i + 1], result):
+                        break
+            except BaseException as e:
+                fail(stage.name, e)
+            finally:
+                with lock:
+                    remaining[i] -= 1
+                    last = remaining[i] == 0
+                if last:    # the last worker out tells every downstream worker to finish
+                    for _ in range(stages[i + 1].workers if i + 1 < len(stages) else 1):
+                        put(queues[i + 1], _DONE)
+
+        threads = [threading.Thread(target=feed, name="pipeline-input", daemon=True)]
+        for i, stage in enumerate(stages):
+            threads += [threading.Thread(target=work, args=(i,), name=f"pipeline-{stage.name}-{w}", daemon=True)
+                        for w in range(stage.workers)]
+        for t in threads:
+            t.start()
+
+        results = []
+        try:
+            while True:
+                item = get(queues[-1])
+                if item is _DONE:
+                    break
+                results.append(item)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for t in threads:
+                t.join()
+            for executor in executors.values():
+                executor.shutdown(cancel_futures=True)
+
+        if errors:
+            name, e = errors[0]
+            raise RuntimeError(f"Pipeline stage '{name}' failed: {e}") from e
+        return results
+
+    def log_stats(self, tag="PIPELINE"):
+        for s in self.stages:
+            logging.info(f"[{tag}] {s.name}: {s.items} items, busy {s.busy:.1f}s, "
+                         f"waiting for input {s.wait:.1f}s ({s.workers} worker(s))")
@@ -0,0 +1,171 @@
+"""
+pipeline_metrics.py
+
+Machine-readable run metrics for the dataset scripts.
+
+    metrics = MetricsCollector("data", labels={"config": "parameter.yml"})
+    with metrics.stage("split", book="moby") as m:
+        sents = split(...)
+        m.items += len(sents)
+        m.bytes_read += path.stat().st_size
+    metrics.write("dataset_alpaca/metrics")   # -> metrics.json + metrics.prom
+
+Per stage (and optional labels such as book) the collector sums wall time,
+CPU time of the calling thread, items, bytes read / written and number of
+calls, and records peak RSS. CPU spent in worker processes is only visible
+once they are reaped, so it is reported for the whole run
+(children_cpu_seconds), not per stage. The .prom file follows the
+Prometheus textfile-collector format and is replaced atomically.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+PROM_PREFIX = "seekhub"
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process and of its reaped children."""
+    if resource is None:
+        return None
+    scale = 1 if os.uname().sysname == "Darwin" else 1024     # ru_maxrss: bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return max(own, children)
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageMetrics:
+    def __init__(self, name, labels, unit):
+        self.name = name
+        self.labels = labels
+        self.unit = unit
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.items = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "labels": self.labels,
+            "calls": self.calls,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "items": self.items,
+            "unit": self.unit,
+            "items_per_second": self.items / self.wall_seconds if self.wall_seconds > 0 else 0.0,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+class MetricsCollector:
+    def __init__(self, job, labels=None):
+        self.job = job
+        self.labels = dict(labels or {})
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._start_wall = time.time()
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._start_children = _children_cpu()
+
+    @contextmanager
+    def stage(self, name, unit="items", **labels):
+        """Time a block; the yielded StageMetrics takes items / bytes_read / bytes_written."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            m = self.stages.get(key)
+            if m is None:
+                m = self.stages[key] = StageMetrics(name, {k: str(v) for k, v in labels.items()}, unit)
+        t0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield m
+        finally:
+            wall, cpu = time.perf_counter() - t0, time.thread_time() - c0
+            with self._lock:
+                m.calls += 1
+                m.wall_seconds += wall
+                m.cpu_seconds += cpu
+
+    def report(self):
+        return {
+            "job": self.job,
+            "labels": self.labels,
+            "started_at": self._start_wall,
+            "wall_seconds": time.perf_counter() - self._start,
+            "cpu_seconds": time.process_time() - self._start_cpu,
+            "children_cpu_seconds": _children_cpu() - self._start_children,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": [m.as_dict() for m in self.stages.values()],
+        }
+
+    def write(self, path_prefix):
+        """Write <path_prefix>.json and <path_prefix>.prom; returns the report."""
+        report = self.report()
+        prefix = Path(path_prefix)
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write(prefix.with_name(prefix.name + ".json"), json.dumps(report, ensure_ascii=False, indent=2))
+        _atomic_write(prefix.with_name(prefix.name + ".prom"), self.prometheus(report))
+        return report
+
+    def prometheus(self, report=None):
+        report = report or self.report()
+        run_labels = {"pipeline": self.job, **self.labels}
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROM_PREFIX}_{name} gauge")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{PROM_PREFIX}_{name}{{{_prom_labels(labels)}}} {value}")
+
+        metric("run_wall_seconds", "Wall time of the run.", [(run_labels, report["wall_seconds"])])
+        metric("run_cpu_seconds", "CPU time of the main process.", [(run_labels, report["cpu_seconds"])])
+        metric("run_children_cpu_seconds", "CPU time of reaped worker processes.",
+               [(run_labels, report["children_cpu_seconds"])])
+        metric("run_peak_rss_bytes", "Peak resident set size.", [(run_labels, report["peak_rss_bytes"])])
+        metric("run_start_timestamp_seconds", "Unix time the run started.", [(run_labels, report["started_at"])])
+
+        stages = [({**run_labels, "stage": s["stage"], **s["labels"]}, s) for s in report["stages"]]
+        for field, help_text in [("wall_seconds", "Wall time spent in the stage."),
+                                 ("cpu_seconds", "CPU time of the threads running the stage."),
+                                 ("items_per_second", "Stage throughput."),
+                                 ("bytes_read", "Bytes read by the stage."),
+                                 ("bytes_written", "Bytes written by the stage."),
+                                 ("calls", "Times the stage ran.")]:
+            metric(f"stage_{field}", help_text, [(labels, s[field]) for labels, s in stages])
+        metric("stage_items", "Items processed by the stage (see the unit label).",
+               [({**labels, "unit": s["unit"]}, s["items"]) for labels, s in stages])
+        return "\n".join(lines) + "\n"
+
+
+def _prom_labels(labels):
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{k}="{esc(v)}"' for k, v in labels.items())
+
+
+def _atomic_write(path, text):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+score_dataset.py
+
+Stream a generated dataset through the BERTScore evaluator and write
+per-record scores to a side file.
+
+Usage:
+  python score_dataset.py --input ./output/alpaca.jsonl --out ./scores
+  python score_dataset.py --input ./en_zh_book_ds --out ./scores
+
+Inputs are the Alpaca JSONL written by data.py (`input` = en, `output` = zh)
+or an `en_zh_book_ds` directory (every split is scored). For each input
+file / split, `<out>/<name>.scores.jsonl` gets one line per record, in
+record order:
+  {"idx": 0, "precision": ..., "recall": ..., "f1": ...}
+
+Re-running resumes after the last complete line of the side file, and
+scores are cached in `<out>/score_cache.sqlite` by pair hash, so records
+already scored (in this or any other dataset) are not scored again.
+"""
+
+import argparse
+import hashlib
+import sqlite3
+from pathlib import Path
+
+from jsonl_writer import dumps_line, iter_jsonl
+from pipeline_metrics import MetricsCollector
+
+# ── 1. score cache ───────────────────────────────────────────────────────────
+class ScoreCache:
+    """sqlite3 table pair_hash -> (precision, recall, f1)."""
+
+    def __init__(self, path: Path, model_id: str):
+        self.model_id = model_id
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scores ("
+                          "hash BLOB PRIMARY KEY, precision REAL, recall REAL, f1 REAL)")
+
+    def key(self, zh: str, en: str) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        for part in (self.model_id, zh, en):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.digest()
+
+    def get_many(self, keys):
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), 500):   # stay under SQLITE_MAX_VARIABLE_NUMBER
+            part = unique[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT hash, precision, recall, f1 FROM scores WHERE hash IN ({','.join('?' * len(part))})",
+                part)
+            found.update((h, (p, r, f)) for h, p, r, f in rows)
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                              [(h, p, r, f) for h, (p, r, f) in items])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# ── 2. side file with resume ────────────────────────────────────────────────
+def open_side_file(path: Path):
+    """Open the score file for appending; return (handle, records already scored)."""
+    done, good_bytes = 0, 0
+    if path.exists():
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):    # torn write from an interrupted run
+                    break
+                done += 1
+                good_bytes += len(line)
+        with open(path, "r+b") as f:
+            f.truncate(good_bytes)
+    return open(path, "ab"), done
+
+# ── 3. scoring loop ─────────────────────────────────────────────────────────
+def score_stream(pairs, side_path: Path, evaluator, cache: ScoreCache,
+                 batch_size: int, eval_batch_size: int, metrics=None):
+    """
+    Score an iterator of (zh, en) pairs whose first `done` items are skipped.
+    `pairs` is a callable taking the start offset, so sources can seek.
+    """
+    metrics = metrics or MetricsCollector("score")
+    fout, done = open_side_file(side_path)
+    start = done
+    scored = cached = 0
+    with metrics.stage("score", unit="records", file=side_path.name) as m:
+        try:
+            batch = []
+            for pair in pairs(done):
+                batch.append(pair)
+                if len(batch) == batch_size:
+                    s, c = _score_batch(batch, done, fout, evaluator, cache, eval_batch_size)
+                    done += len(batch); scored += s; cached += c
+                    batch = []
+            if batch:
+                s, c = _score_batch(batch, done, fout, evaluator, cache, eval_batch_size)
+                done += len(batch); scored += s; cached += c
+        finally:
+            fout.close()
+        m.items += done - start
+        m.bytes_written += side_path.stat().st_size
+    print(f"🔹 {side_path.name}: {done} records ({scored} scored, {cached} from cache)")
+
+def _score_batch(batch, first_idx, fout, evaluator, cache, eval_batch_size):
+    keys = [cache.key(zh, en) for zh, en in batch]
+    found = cache.get_many(keys)
+    todo = [i for i, k in enumerate(keys) if k not in found]
+    # identical pairs inside one batch are scored once
+    todo = list({keys[i]: i for i in todo}.values())
+    if todo:
+        res = evaluator.evaluate_batch([batch[i][0] for i in todo], [batch[i][1] for i in todo],
+                                       batch_size=eval_batch_size)
+        new = [(keys[i], (float(p), float(r), float(f)))
+               for i, p, r, f in zip(todo, res["precision"], res["recall"], res["f1"])]
+        cache.put_many(new)
+        found.update(new)
+
+    fout.write(b"".join(
+        dumps_line({"idx": first_idx + i, "precision": p, "recall": r, "f1": f})
+        for i, (p, r, f) in enumerate(found[k] for k in keys)))
+    fout.flush()
+    return len(todo), len(batch) - len(todo)
+
+# ── 4. sources ───────────────────────────────────────────────────────────────
+def jsonl_pairs(path):
+    def pairs(start):
+        for record in iter_jsonl(path, start=start):
+            yield record["output"], record["input"]
+    return pairs
+
+def arrow_pairs(ds, read_batch: int):
+    def pairs(start):
+        for lo in range(start, len(ds), read_batch):
+            batch = ds[lo:lo + read_batch]
+            yield from zip(batch["zh"], batch["en"])
+    return pairs
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream BERTScore quality scores over a dataset")
+    parser.add_argument("--input", required=True, help="Alpaca JSONL file or en_zh_book_ds directory")
+    parser.add_argument("--out", required=True, help="directory for score files and the cache")
+    parser.add_argument("--model-type", default=None, help="override the tier's model")
+    parser.add_argument("--tier", default="accurate", help="evaluator tier: accurate | fast | fastest")
+    parser.add_argument("--batch-size", type=int, default=2048, help="records read per step")
+    parser.add_argument("--eval-batch-size", type=int, default=64, help="pairs per forward pass")
+    args = parser.parse_args()
+
+    from translation_evaluator import TranslationEvaluator
+
+    inp, out = Path(args.input), Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    evaluator = TranslationEvaluator(model_type=args.model_type, tier=args.tier)
+    cache = ScoreCache(out / "score_cache.sqlite", evaluator.model_id)
+    metrics = MetricsCollector("score", labels={"tier": args.tier})
+    try:
+        if (inp / "dataset_dict.json").exists():
+            from datasets import load_from_disk
+            dsd = load_from_disk(str(inp))
+            for split in dsd:
+                score_stream(arrow_pairs(dsd[split], args.batch_size),
+                             out / f"{inp.name}.{split}.scores.jsonl",
+                             evaluator, cache, args.batch_size, args.eval_batch_size, metrics)
+        else:
+            score_stream(jsonl_pairs(inp), out / f"{inp.name}.scores.jsonl",
+                         evaluator, cache, args.batch_size, args.eval_batch_size, metrics)
+    finally:
+        cache.close()
+    metrics.write(out / "metrics")
+
+if __name__ == "__main__":
+    main()
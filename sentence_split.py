@@ -0,0 +1,44 @@
+"""
+Sentence-splitting workers for data.py's preprocessing pool.
+
+The pool runs with the spawn start method, so every worker imports the
+modules of the functions it is sent. Keeping the splitters and the OpenCC
+conversion here means a worker only loads nltk and opencc, not the
+tokenizer and alignment stack that data.py needs.
+"""
+
+import re
+from pathlib import Path
+
+import nltk
+
+try:
+    from opencc import OpenCC
+except ImportError:
+    OpenCC = None
+
+# Configure NLTK to use local data directory
+NLTK_DATA_DIR = Path("./nltk_data").absolute()
+nltk.data.path.insert(0, str(NLTK_DATA_DIR))
+
+def en_sents(text, min_len=2):
+    """Return (sentences of at least min_len chars, number of sentences before filtering)."""
+    sents = nltk.sent_tokenize(text)
+    return [s.strip() for s in sents if len(s.strip()) >= min_len], len(sents)
+
+def zh_sents(text, min_len=2):
+    sents = [s for s in re.split(r'(?<=[。！？])\s*', text) if s.strip()]
+    return [s.strip() for s in sents if len(s.strip()) >= min_len], len(sents)
+
+SPLITTERS = {"en": en_sents, "zh": zh_sents}
+_t2s = None
+
+def split_chunk(lang, text, min_len):
+    return SPLITTERS[lang](text, min_len)
+
+def convert_t2s(text):
+    """Traditional -> simplified Chinese; one OpenCC converter per process."""
+    global _t2s
+    if _t2s is None:
+        _t2s = OpenCC("t2s")
+    return _t2s.convert(text)